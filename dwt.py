@@ -1,3 +1,4 @@
+import functools
 import math
 import warnings
 
@@ -8,7 +9,8 @@ import numpy as np
 def haar_transform(x: numpy.ndarray, h: numpy.ndarray = None, orthogonal=True, shape_conform_mode='rpad', shape_conform_pad_value='median'):
     """
     Perform 1-d discrete Haar wavelet transform.
-    :param x: input signal with shape (n_signals, n_samples_per_signal)
+    :param x: input signal with shape (n_signals, n_samples_per_signal). Transformed in its own floating point
+        precision, integer input is converted to float64.
     :param h: (optional) Haar transformation matrix. Provide cached matrix for performance.
     :param orthogonal: orthogonal transformation is likely slower (default True)
     :param shape_conform_mode: how to handle data lengths that aren't powers of two. Can be 'rtrim', 'ltrim', 'lrtrim', 'rpad', 'lpad', 'lrpad' (default 'rpad')
@@ -18,7 +20,10 @@ def haar_transform(x: numpy.ndarray, h: numpy.ndarray = None, orthogonal=True, s
         h - haar matrix used for transformation
     """
 
-    x = np.asarray(x, dtype=np.float64)
+    # Floating point input keeps its precision (float32 halves memory traffic of the matmul), anything else is float64
+    x = np.asarray(x)
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(np.float64)
 
     n_samples = x.shape[1]
 
@@ -27,11 +32,11 @@ def haar_transform(x: numpy.ndarray, h: numpy.ndarray = None, orthogonal=True, s
         x = _conform_shape_to_pow2(x, axis=1, mode=shape_conform_mode, pad_with=shape_conform_pad_value)
         n_samples = x.shape[1]
 
-    # Calculate Haar matrix
+    # Calculate Haar matrix, or reuse the one from a previous call with the same length
     if h is None:
-        h = haar_matrix(n_samples, orthogonal)
+        h = _cached_haar_matrix(n_samples, orthogonal)
 
-    y = x @ h.T
+    y = x @ h.T.astype(x.dtype, copy=False)
 
     return y, h
 
@@ -70,6 +75,14 @@ def haar_matrix(n=2, orthogonal=True):
     return h
 
 
+@functools.lru_cache(maxsize=16)
+def _cached_haar_matrix(n: int, orthogonal: bool) -> np.ndarray:
+    """haar_matrix(n, orthogonal), built once per (n, orthogonal). Read-only, because it is shared between calls."""
+    h = haar_matrix(n, orthogonal)
+    h.flags.writeable = False
+    return h
+
+
 def _haar_matrix_recursive(k, orthogonal=True):
     if k > 1:
         h = _haar_matrix_recursive(k - 1, orthogonal)
@@ -7,10 +7,13 @@ __all__ = ["ClusterItem", "ClusterTreeItem", "ClusterTreeModel", "ClusterSelecto
 
 # noinspection PyPep8Naming
 def labelsToIndices(labels: np.ndarray) -> list[np.ndarray]:
-    indices = []
-    for i in np.unique(labels):
-        indices.append(np.where(labels == i)[0])
-    return indices
+    # One sort instead of a full scan of labels per cluster. Clusters are ordered by label, with empty labels skipped.
+    _, inverse = np.unique(labels, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if inverse.size == 0:
+        return []
+    order = np.argsort(inverse, kind='stable')
+    return np.split(order, np.cumsum(np.bincount(inverse))[:-1])
 
 
 # noinspection PyPep8Naming
@@ -6,6 +6,8 @@ from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QColor
 from ..color import ColorRange
 
+_BLACK = QColor(0, 0, 0)  # Color of branch items. Shared, do not modify.
+
 
 # noinspection PyPep8Naming
 class ClusterItem(ABC):
@@ -93,6 +95,7 @@ class ClusterTreeItem(ClusterItem):
 
     _children: list[ClusterTreeItem]
     _parent: ClusterTreeItem | None
+    _row: int  # row in parent._children, maintained by insertChildren/removeChildren
     _name: str = ''
     _checkState: Qt.CheckState = Qt.CheckState.Checked
     _indices: np.ndarray | None
@@ -110,6 +113,7 @@ class ClusterTreeItem(ClusterItem):
         self._checkState = checkState
         self._children = []
         self._parent = None
+        self._row = 0
         self._indices = indices
         self._cachedIndices = None
         self._unassignedIndices = None
@@ -128,12 +132,15 @@ class ClusterTreeItem(ClusterItem):
 
         item = ClusterTreeItem(name)
 
+        # Build all children first and insert them in one go, rather than re-dirtying the parent once per child
+        childItems = []
         for i in range(len(indices)):
             if isinstance(indices[i], np.ndarray):
                 childItem = ClusterTreeItem(f"{name}-{i + 1}", indices[i])
             else:
                 childItem = ClusterTreeItem.fromIndices(f"{name}-{i + 1}", indices[i])
-            item.insertChild(item.childCount(), childItem)
+            childItems.append(childItem)
+        item.insertChildren(0, childItems)
         return item
 
     def isValid(self) -> bool:
@@ -278,15 +285,19 @@ class ClusterTreeItem(ClusterItem):
         return self._checkState
 
     @checkState.setter
-    def checkState(self, value: Qt.CheckState):
+    def checkState(self, value: Qt.CheckState | int):
         if isinstance(value, int):
             value = Qt.CheckState(value)
+        self.setCheckState(value)
+
+    def setCheckState(self, value: Qt.CheckState):
+        """Same as the checkState setter, but value must already be a Qt.CheckState."""
         self._checkState = value
         # Notify parents, recursively, until we hit root
         parent = self.parent
         while parent is not None:
             if value is not Qt.CheckState.PartiallyChecked and all(
-                    [child.checkState == value for child in parent._children]):
+                    child._checkState is value for child in parent._children):
                 parent._checkState = value
             else:
                 parent._checkState = Qt.CheckState.PartiallyChecked
@@ -314,7 +325,7 @@ class ClusterTreeItem(ClusterItem):
         if self.childCount() == 0:
             return self.colorRange.color
         else:
-            return QColor(0, 0, 0)
+            return _BLACK
 
     @property
     def colorRange(self):
@@ -337,18 +348,25 @@ class ClusterTreeItem(ClusterItem):
         return len(self._children)
 
     def row(self) -> int:
-        """Returns row number by searching in self.parent.children. Return 0 if parent is None"""
+        """Returns row number in self.parent.children. Return 0 if parent is None"""
         if self._parent is not None:
-            return self._parent._children.index(self)
+            return self._row
         return 0
 
+    def _updateChildRows(self, start: int = 0):
+        """Re-number cached rows of children from start onwards, after children were inserted or removed."""
+        for i in range(start, len(self._children)):
+            self._children[i]._row = i
+
     def insertChildren(self, row: int, items: typing.Iterable[ClusterTreeItem]):
         if row < 0:
             raise ValueError(f"cannot insert, desired row index {row} is out of range [0, {len(self._children)}].")
         row = min(len(self._children), row)
+        items = list(items)
         self._children[row:row] = items
         for item in items:
             item.parent = self
+        self._updateChildRows(row)
         self.indices = None
         # self.dirty = True  # Moved to indices.setter
 
@@ -357,6 +375,7 @@ class ClusterTreeItem(ClusterItem):
             c.parent = None
         items = self._children[row:row + count]
         del self._children[row:row + count]
+        self._updateChildRows(row)
         self.indices = None
         # self.dirty = True  # Moved to indices.setter
         return items
@@ -421,21 +440,12 @@ class ClusterTreeItem(ClusterItem):
             raise ValueError(f"Cannot merge all {len(items)} items because list contains direct descendants.")
 
         # Convert branch nodes to leaf nodes
-        leafItems = items.copy()
-        for item in leafItems:
-            if item.isBranch():
-                leafItems.remove(item)
-                leafItems.extend(item.leaves())
-
-        # Pre-allocate and merge indices
-        size = 0
-        for item in leafItems:
-            size += item.size
-        mergedIndices = np.empty((size,), dtype=np.uint32)
-        i = 0
-        for item in leafItems:
-            mergedIndices[i:i+item.size] = item.indices
-            i += item.size
+        leafIndices = [leaf.indices for item in items for leaf in item.leaves() if leaf.size > 0]
+
+        # Pre-allocate and concatenate indices in one call
+        mergedIndices = np.empty((sum([i.size for i in leafIndices]),), dtype=np.uint32)
+        if leafIndices:
+            np.concatenate(leafIndices, out=mergedIndices, casting='unsafe')
 
         # Find the widest ColorRange among all items
         maxColorRange = max(items, key=lambda it: it.colorRange.width).colorRange
@@ -453,7 +463,7 @@ class ClusterTreeItem(ClusterItem):
         """
         from spikeclustering import cluster
         labels = cluster(data.features[self.indices, :], n_clusters=n, method=method)
-        nSubClusters = labels.max(initial=-1) + 1
+        nSubClusters = int(labels.max()) + 1 if labels.size else 0
 
         indices = self.indices
         splitIndices = []
@@ -2,12 +2,28 @@ from __future__ import annotations  # allows TreeItem type hint in its own const
 import typing
 
 import numpy as np
-from PyQt6.QtCore import QAbstractItemModel, pyqtSignal, QModelIndex, Qt, QVariant, QMimeData, QByteArray, QDataStream, \
-    QIODevice
+from PyQt6.QtCore import QAbstractItemModel, pyqtSignal, QModelIndex, Qt, QMimeData, QByteArray
 from PyQt6.QtWidgets import QWidget
 from .item import ClusterTreeItem
 
 
+def _displayText(item: ClusterTreeItem) -> str:
+    if item.isLeaf():
+        return f"{item.name} ({item.selectedSize}/{item.size})"
+    return f"{item.name} ({item.selectedSize}/{item.size}, group)"
+
+
+# Item data getter for each role served by ClusterTreeModel.data(), looked up once per call
+_DATA_ROLE_GETTERS = {
+    Qt.ItemDataRole.DisplayRole: _displayText,
+    Qt.ItemDataRole.EditRole: lambda item: item.name,
+    Qt.ItemDataRole.ToolTipRole: lambda item: f"{item.size}",
+    Qt.ItemDataRole.CheckStateRole: lambda item: item.checkState,
+    Qt.ItemDataRole.UserRole: lambda item: item.indices,
+    Qt.ItemDataRole.ForegroundRole: lambda item: item.color,
+}
+
+
 # noinspection PyPep8Naming
 class ClusterTreeModel(QAbstractItemModel):
     from spikedata import SpikeData
@@ -16,6 +32,8 @@ class ClusterTreeModel(QAbstractItemModel):
     spikeFeatures: SpikeFeatures | None
     spikeSelection: np.ndarray | None  # array of booleans, indicating whether each spike is selected
     rootItem: ClusterTreeItem
+    _possiblyRedundantParents: dict[int, ClusterTreeItem]  # parents that lost children, or were inserted/left with a single child, keyed by id()
+    _changedParents: dict[int, ClusterTreeItem]  # parents that gained or lost children, keyed by id()
     _mimeType = "application/vnd.text.list"
 
     # signals
@@ -27,6 +45,8 @@ class ClusterTreeModel(QAbstractItemModel):
     def __init__(self, parent: QWidget = None):
         super().__init__(parent)
         self.rootItem = ClusterTreeItem('Root')
+        self._possiblyRedundantParents = {}
+        self._changedParents = {}
         self.spikeData = None
         self.spikeFeatures = None
 
@@ -37,6 +57,9 @@ class ClusterTreeModel(QAbstractItemModel):
         self.beginResetModel()
         del self.rootItem
         self.rootItem = ClusterTreeItem.fromIndices('Root', indices)
+        ClusterTreeModel._collapseSingleChildChains(self.rootItem)
+        self._possiblyRedundantParents.clear()
+        self._changedParents.clear()
         leaves = self.rootItem.leaves()
         from ..names import randomNames
         leafNames = randomNames(count=len(leaves), seed=seed)
@@ -94,33 +117,24 @@ class ClusterTreeModel(QAbstractItemModel):
     def headerData(self, section: int, orientation: Qt.Orientation, role: int = None):
         if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
             return f"{self.rootItem.selectedSize}/{self.rootItem.size} classified, {self.rootItem.unassignedSize} unassigned"
-        return QVariant()
+        return None
 
     def data(self, index: QModelIndex, role=None):
-        if index is None or not index.isValid():
-            return QVariant()
-
+        # Check the role first, it's a pure python lookup. An invalid index has no internal pointer.
+        # None is converted to an invalid QVariant by PyQt, without constructing one here.
+        getter = _DATA_ROLE_GETTERS.get(role)
+        if getter is None or index is None:
+            return None
         item: ClusterTreeItem = index.internalPointer()
-        if role == Qt.ItemDataRole.DisplayRole:
-            return f"{item.name} ({item.selectedSize}/{item.size})" if item.isLeaf() else f"{item.name} ({item.selectedSize}/{item.size}, group)"
-        elif role == Qt.ItemDataRole.EditRole:
-            return item.name
-        elif role == Qt.ItemDataRole.ToolTipRole:
-            return f"{item.size}"
-        elif role == Qt.ItemDataRole.CheckStateRole:
-            return item.checkState
-        elif role == Qt.ItemDataRole.UserRole:
-            return item.indices
-        elif role == Qt.ItemDataRole.ForegroundRole:
-            return item.color
-        else:
-            return QVariant()
+        if item is None:
+            return None
+        return getter(item)
 
     def setData(self, index: QModelIndex, value: typing.Any, role: int = None) -> bool:
-        if index is None or not index.isValid():
+        item: ClusterTreeItem = index.internalPointer() if index is not None else None
+        if item is None:
             return False
 
-        item: ClusterTreeItem = index.internalPointer()
         if role == Qt.ItemDataRole.DisplayRole | Qt.ItemDataRole.EditRole:
             item.name = value
             self.dataChanged.emit(index, index, [role])
@@ -160,32 +174,27 @@ class ClusterTreeModel(QAbstractItemModel):
         return [self._mimeType]
 
     def mimeData(self, indexes: typing.Iterable[QModelIndex]) -> QMimeData:
-        encodedData = QByteArray()
-        stream = QDataStream(encodedData, QIODevice.OpenModeFlag.WriteOnly)
+        # Each path is encoded as [depth, row_0, row_1, ..., row_depth-1], one uint8 per value
+        buffer = bytearray()
 
         # Get path to index
         for index in indexes:
-            path = []
-            parentIndex = index
-            while parentIndex.isValid():
-                path.insert(0, parentIndex.row())
-                parentIndex = parentIndex.parent()
-            stream.writeUInt8(len(path))
-            for i in path:
-                stream.writeUInt8(i)
+            path = self.indexToPath(index)
+            buffer.append(len(path))
+            buffer.extend(path)
 
         mimeData = QMimeData()
-        mimeData.setData(self._mimeType, encodedData)
+        mimeData.setData(self._mimeType, QByteArray(bytes(buffer)))
         return mimeData
 
     def _parseMimeData(self, data: QMimeData) -> list[list[int]]:
-        encodedData = data.data(self._mimeType)
-        stream = QDataStream(encodedData, QIODevice.OpenModeFlag.ReadOnly)
+        buffer = bytes(data.data(self._mimeType))
         paths = []
-        while not stream.atEnd():
-            depth = stream.readUInt8()
-            path = [stream.readUInt8() for _ in range(depth)]
-            paths.append(path)
+        i = 0
+        while i < len(buffer):
+            depth = buffer[i]
+            paths.append(list(buffer[i + 1:i + 1 + depth]))
+            i += 1 + depth
         return paths
 
     def canDropMimeData(self, data: QMimeData, action: Qt.DropAction, row: int, column: int,
@@ -196,18 +205,18 @@ class ClusterTreeModel(QAbstractItemModel):
 
         # Cannot move an item along with its ancestor or descendent
         paths = self._parseMimeData(data)
+        pathSet = {tuple(path) for path in paths}
         for path in paths:
-            path = path.copy()
-            while len(path) > 0:
-                del path[len(path) - 1]
-                if path in paths:
+            for depth in range(len(path)):
+                if tuple(path[:depth]) in pathSet:
                     return False
 
-        # Cannot move an item onto its current parent
+        # Cannot move an item onto its current parent. Compare items by identity rather than comparing QModelIndex's.
         if row == -1 and parent.isValid():
+            parentItem = parent.internalPointer()
             for path in paths:
-                parentIndex = self.pathToIndex(path).parent()
-                if parentIndex == parent:
+                item = self.pathToIndex(path).internalPointer()
+                if item is not None and item.parent is parentItem:
                     return False
 
         return True
@@ -228,7 +237,8 @@ class ClusterTreeModel(QAbstractItemModel):
             removedItem = self.removeItem(index.row(), parentIndex)
             if removedItem is None:
                 return False
-            items.insert(0, removedItem)
+            items.append(removedItem)
+        items.reverse()
 
         # Insert removed items into new position
         parentItem = parent.internalPointer() if parent.isValid() else self.rootItem
@@ -246,15 +256,41 @@ class ClusterTreeModel(QAbstractItemModel):
 
         self.removeInvalidChildren()
         self.removeRedundantParents()
-        self.recolorChildItems(self.rootItem)
+        self.recolorChangedItems()
 
-        # Refresh CheckState (for visual update only)
-        newIndices = [self.index(item.row(), 0, parent) for item in items]
-        for i in range(len(newIndices)):
-            self.setData(newIndices[i], items[i].checkState, Qt.ItemDataRole.CheckStateRole)
+        # Refresh CheckState (for visual update only). Items detached by removeRedundantParents are skipped.
+        items = [item for item in items if item.parent is not None]
+        changedItems = []
+        for item in items:
+            item.setCheckState(item.checkState)
+            changedItems.extend(item.traversal())
+        self.itemsCheckStateChanged.emit(changedItems)
+        self._emitCheckStateDataChanged(items)
 
         return True
 
+    def _emitCheckStateDataChanged(self, items: typing.Iterable[ClusterTreeItem]):
+        """Emit dataChanged (CheckStateRole) once per affected range: the rows under each item's parent, the children
+        of each item, and every ancestor up to root."""
+        role = Qt.ItemDataRole.CheckStateRole
+        notifiedParents = set()
+        notifiedAncestors = set()
+        for item in items:
+            for parentItem in (item.parent, item):
+                if parentItem.childCount() == 0 or id(parentItem) in notifiedParents:
+                    continue
+                notifiedParents.add(id(parentItem))
+                parentIndex = self.indexFromItem(parentItem)
+                self.dataChanged.emit(self.index(0, 0, parentIndex), self.index(parentItem.childCount() - 1, 0, parentIndex), [role])
+
+            # Update ancestors, recursively to root
+            ancestor = item.parent
+            while ancestor is not self.rootItem and id(ancestor) not in notifiedAncestors:
+                notifiedAncestors.add(id(ancestor))
+                ancestorIndex = self.indexFromItem(ancestor)
+                self.dataChanged.emit(ancestorIndex, ancestorIndex, [role])
+                ancestor = ancestor.parent
+
     def insertItems(self, row: int, items: typing.Sequence[ClusterTreeItem], parent: QModelIndex = QModelIndex()) -> bool:
         if not parent.isValid():
             parentItem = self.rootItem
@@ -269,10 +305,19 @@ class ClusterTreeModel(QAbstractItemModel):
         self.beginInsertRows(parent, row, row + len(items) - 1)
         parentItem.insertChildren(row, items)
         self.endInsertRows()
+        self._changedParents[id(parentItem)] = parentItem
 
         # Signal the addition of this item, and all its children
         allItems = []
         [allItems.extend(item.traversal()) for item in items]
+
+        # Inserted subtrees (e.g. a split into a single sub-cluster) may bring their own single-child parents
+        for item in allItems:
+            if item.childCount() == 1:
+                self._possiblyRedundantParents[id(item)] = item
+        if parentItem.childCount() == 1:
+            self._possiblyRedundantParents[id(parentItem)] = parentItem
+
         self.itemsAdded.emit(allItems)
 
         return True
@@ -295,6 +340,8 @@ class ClusterTreeModel(QAbstractItemModel):
         self.beginRemoveRows(parent, row, row + count - 1)
         items = parentItem.removeChildren(row, count)
         self.endRemoveRows()
+        self._possiblyRedundantParents[id(parentItem)] = parentItem
+        self._changedParents[id(parentItem)] = parentItem
 
         # Signal the removal of this item and all its children
         allItems = []
@@ -311,20 +358,79 @@ class ClusterTreeModel(QAbstractItemModel):
         else:
             return items[0]
 
+    def removeSortedIndices(self, indices: typing.Sequence[QModelIndex]):
+        """
+        Remove items at indices, which must be sorted from bottom to top (see sortIndices). Adjacent siblings are
+        removed with a single removeItems() call per contiguous run of rows.
+        """
+        i = 0
+        while i < len(indices):
+            parentIndex = indices[i].parent()
+            parentItem = indices[i].internalPointer().parent
+            lastRow = indices[i].row()
+            count = 1
+            # Extend the run while the next index is the sibling directly above
+            while i + count < len(indices) and indices[i + count].row() == lastRow - count and \
+                    indices[i + count].internalPointer().parent is parentItem:
+                count += 1
+            row = lastRow - count + 1
+            if self.removeItems(row, count, parentIndex) is None:
+                raise RuntimeError(f"Failed to remove {count} items at row {row} for parent path {self.indexToPath(parentIndex)}")
+            i += count
+
     def recolorChildItems(self, item: ClusterTreeItem = None):
         """Reassign colors for an item's descendants."""
 
         if item is None:
             item = self.rootItem
+        if item is self.rootItem:
+            self._changedParents.clear()
+
+        recoloredItems = self._recolorSubtree(item)
+        if recoloredItems:
+            self.itemsRecolored.emit(recoloredItems)
+
+    def recolorChangedItems(self):
+        """Reassign colors only below parents that gained or lost children since the last call (see insertItems,
+        removeItems). Subtrees that were not restructured keep their colors."""
+        changedParents = self._changedParents
+        self._changedParents = {}
+
+        # Skip parents that were since removed from the tree, or that will be recolored as part of a changed ancestor
+        recoloredItems = []
+        for parentItem in changedParents.values():
+            ancestor = parentItem.parent
+            while ancestor is not None and id(ancestor) not in changedParents:
+                ancestor = ancestor.parent
+            if ancestor is not None:
+                continue
+            if self._isAttached(parentItem):
+                recoloredItems.extend(self._recolorSubtree(parentItem))
+
+        if recoloredItems:
+            self.itemsRecolored.emit(recoloredItems)
+
+    def _isAttached(self, item: ClusterTreeItem) -> bool:
+        """True if item is the root item or one of its descendants."""
+        while item is not None and item is not self.rootItem:
+            item = item.parent
+        return item is self.rootItem
 
-        childCount = item.childCount()
-        if childCount > 0:
-            colorRanges = item.colorRange.split(childCount, 'hue')
-            for i in range(childCount):
-                child = item.child(i)
-                child.colorRange = colorRanges[i]
-                self.recolorChildItems(child)
-            self.itemsRecolored.emit(item.children())
+    @staticmethod
+    def _recolorSubtree(item: ClusterTreeItem) -> list[ClusterTreeItem]:
+        """Split color ranges top-down without recursion. Returns all descendants of item."""
+        recoloredItems = []
+        parents = [item]
+        while parents:
+            parent = parents.pop()
+            childCount = parent.childCount()
+            if childCount > 0:
+                children = parent.children()
+                for child, colorRange in zip(children, parent.colorRange.split(childCount, 'hue')):
+                    child.colorRange = colorRange
+                recoloredItems.extend(children)
+                parents.extend(children)
+        return recoloredItems
 
     def removeInvalidChildren(self, parentIndex: QModelIndex = QModelIndex()):
         """Recursively remove invalid (childless groups/leaves with empty cluster indices) ClusterTreeItem's from model."""
@@ -339,29 +445,73 @@ class ClusterTreeModel(QAbstractItemModel):
             else:
                 self.removeItem(i, parentIndex)
 
-    def removeRedundantParents(self, index: QModelIndex = None) -> QModelIndex:
-        if index is None:
-            for leaf in self.leafIndices():
-                self.removeRedundantParents(leaf)
+    def removeRedundantParents(self, item: ClusterTreeItem = None):
+        """
+        Replace chains of single-child parents with their (single) leaf descendant. By default, only parents recorded
+        since the last call are checked: parents that lost children (see removeItems), and single-child items inserted
+        or left with a single child (see insertItems). Provide an item to check its entire subtree.
+        """
+        if item is None:
+            candidates = list(self._possiblyRedundantParents.values())
+            self._possiblyRedundantParents.clear()
+            for parentItem in candidates:
+                top = self._topOfSingleChildChain(parentItem)
+                if top is not None:
+                    self._collapseSingleChildChain(top)
+            # Collapsing a chain swaps one child for another, so it cannot create new redundant parents
+            self._possiblyRedundantParents.clear()
             return
 
-        """Recursively replace single-child parents with its (single) child. Returns new index."""
-        if not index.isValid():
-            return index
+        for child in item.children():
+            if not self._collapseSingleChildChain(child) and child.isBranch():
+                self.removeRedundantParents(child)
 
-        # Find top-most single-parent
-        parentIndex = index
-        while parentIndex.parent().isValid() and self.rowCount(parentIndex.parent()) == 1:
-            parentIndex = parentIndex.parent()
+    @staticmethod
+    def _collapseSingleChildChains(item: ClusterTreeItem):
+        """Same as removeRedundantParents(item), but on the items only, without model signals. For trees that are not
+        (yet) shown by the model, e.g. while it is being reset."""
+        for row, child in enumerate(item.children()):
+            node = child
+            while node.childCount() == 1:
+                node = node.child(0)
+            if node is not child and node.isLeaf():
+                item.removeChildren(row, 1)
+                item.insertChildren(row, [node])
+            elif child.isBranch():
+                ClusterTreeModel._collapseSingleChildChains(child)
+
+    def _topOfSingleChildChain(self, item: ClusterTreeItem) -> ClusterTreeItem | None:
+        """Top-most single-child ancestor of a single-child item (or the item itself). Returns None if item does not
+        have exactly one child, is the root item, or is no longer attached to the root item."""
+        if item is self.rootItem or item.childCount() != 1:
+            return None
+        top = item
+        while top.parent is not None and top.parent is not self.rootItem and top.parent.childCount() == 1:
+            top = top.parent
+
+        # Items removed from the model may still hold references to their old parents
+        return top if self._isAttached(top) else None
 
-        if parentIndex == index:
-            return index
+    def _collapseSingleChildChain(self, top: ClusterTreeItem) -> bool:
+        """Replace top with the leaf at the bottom of its single-child chain. Returns True if the chain was collapsed."""
+        node = top
+        while node.childCount() == 1:
+            node = node.child(0)
 
-        row = parentIndex.row()
-        grandparentIndex = parentIndex.parent()
+        if node is top or not node.isLeaf():
+            return False
+
+        row = top.row()
+        parentIndex = self.indexFromItem(top.parent)
+        self.removeItem(row, parentIndex)
+        self.insertItem(row, node, parentIndex)
+        return True
 
-        self.removeItem(row, grandparentIndex)
-        self.insertItem(row, index.internalPointer(), grandparentIndex)
+    def indexFromItem(self, item: ClusterTreeItem) -> QModelIndex:
+        """Return model index for item, without walking the tree. Returns an invalid index for the root item."""
+        if item is None or item is self.rootItem:
+            return QModelIndex()
+        return self.createIndex(item.row(), 0, item)
 
     def pathToIndex(self, path: list[int]) -> QModelIndex:
         if len(path) == 0:
@@ -378,7 +528,8 @@ class ClusterTreeModel(QAbstractItemModel):
         path = [index.row()]
         while index.parent().isValid():
             index = index.parent()
-            path.insert(0, index.row())
+            path.append(index.row())
+        path.reverse()
         return path
 
     @staticmethod
@@ -392,25 +543,23 @@ class ClusterTreeModel(QAbstractItemModel):
             index = index.parent()
         return depth
 
-    @staticmethod
-    def pathOrder(path: typing.Sequence[int], maxDepth: int):
-        value = 0
-        for j in range(len(path)):
-            value += 2 ** (8 * (maxDepth - j - 1)) * path[j]
-        return value
-
     @staticmethod
     def sortPaths(paths: list[list[int]], reverse=True):
         """Sort paths from bottom of tree to top of tree."""
 
         maxDepth = max([len(p) for p in paths])
 
-        paths.sort(key=lambda path: ClusterTreeModel.pathOrder(path, maxDepth), reverse=reverse)
+        # Paths come from mime data (one uint8 per row), so zero-padded bytes sort them top to bottom
+        paths.sort(key=lambda path: bytes(path).ljust(maxDepth, b'\x00'), reverse=reverse)
 
     @staticmethod
     def sortIndices(indices: list[QModelIndex], reverse=True):
-        maxDepth = max([ClusterTreeModel.indexDepth(index) for index in indices])
-        indices.sort(key=lambda index: ClusterTreeModel.pathOrder(ClusterTreeModel.indexToPath(index), maxDepth), reverse=reverse)
+        # Resolve each path once, then sort (path, index) pairs on the zero-padded path. Tuples are used instead of
+        # bytes because, unlike mime paths, row numbers here are not limited to uint8.
+        paths = [ClusterTreeModel.indexToPath(index) for index in indices]
+        maxDepth = max([len(p) for p in paths])
+        decorated = sorted(zip(paths, indices), key=lambda pi: tuple(pi[0]) + (0,) * (maxDepth - len(pi[0])), reverse=reverse)
+        indices[:] = [index for _, index in decorated]
 
     def leafIndices(self, index: typing.Iterable[QModelIndex] | QModelIndex = QModelIndex()) -> list[QModelIndex]:
         """
@@ -426,25 +575,29 @@ class ClusterTreeModel(QAbstractItemModel):
                 leaves.extend(self.leafIndices(self.index(i, 0, index)))
             return leaves
         else:
-            indices = set()
-            [indices.update(self.leafIndices(idx)) for idx in index]
-            return list(indices)
+            # De-duplicate by item identity, rather than hashing QModelIndex's
+            leaves = {}
+            for idx in index:
+                for leaf in self.leafIndices(idx):
+                    leaves.setdefault(id(leaf.internalPointer()), leaf)
+            return list(leaves.values())
 
     def canMerge(self, indices: typing.Sequence[QModelIndex]) -> bool:
         """List should not (partially) contain descendants, unless all descendants are in the list."""
         if len(indices) <= 1:
             return False
 
-        # Check if list contains (some, but not all) direct descendants of any other item in list
+        # Check if list contains (some, but not all) direct descendants of any other item in list. Items are keyed by
+        # id() since ClusterTreeItem hashes/compares by its indices array.
+        selectedIds = {id(index.internalPointer()) for index in indices}
         for index in indices:
-            parentIndex = index.parent()
-            while parentIndex.isValid():
+            parentItem = index.internalPointer().parent
+            while parentItem is not None and parentItem is not self.rootItem:
                 # If a parent is in the list, then all its children must be in the list
-                if parentIndex in indices:
-                    for i in range(self.rowCount(parentIndex)):
-                        if self.index(i, 0, parentIndex) not in indices:
-                            return False
-                parentIndex = parentIndex.parent()
+                if id(parentItem) in selectedIds:
+                    if not all(id(child) in selectedIds for child in parentItem.children()):
+                        return False
+                parentItem = parentItem.parent
         return True
 
     def merge(self, indices: list[QModelIndex]) -> bool:
@@ -467,11 +620,7 @@ class ClusterTreeModel(QAbstractItemModel):
         mergedItem = ClusterTreeItem.merge([index.internalPointer() for index in indices], name='+'.join([idx.internalPointer().name for idx in indices][::-1]))#, name=shallowestIndex.internalPointer().name)
 
         # Remove merged items
-        for index in indices:
-            parentIndex = index.parent()
-            row = index.row()
-            if self.removeItem(row, parentIndex) is None:
-                raise RuntimeError(f"Failed to remove item at row {row} for parent path {self.indexToPath(parentIndex)}")
+        self.removeSortedIndices(indices)
 
         # Insert merged item
         if not self.insertItem(targetRow, mergedItem, targetParentIndex):
@@ -480,7 +629,7 @@ class ClusterTreeModel(QAbstractItemModel):
         # Remove invalid children
         self.removeInvalidChildren()
         self.removeRedundantParents()
-        self.recolorChildItems(self.rootItem)
+        self.recolorChangedItems()
         return True
 
     def canSplit(self, indices: list[QModelIndex]) -> bool:
@@ -523,16 +672,12 @@ class ClusterTreeModel(QAbstractItemModel):
         self.rootItem.addUnassignedIndices(mergedItem.indices)
 
         # Remove merged items
-        for index in indices:
-            parentIndex = index.parent()
-            row = index.row()
-            if self.removeItem(row, parentIndex) is None:
-                raise RuntimeError(f"Failed to remove item at row {row} for parent path {self.indexToPath(parentIndex)}")
+        self.removeSortedIndices(indices)
 
         # Remove invalid/redundant items
         self.removeInvalidChildren()
         self.removeRedundantParents()
-        self.recolorChildItems(self.rootItem)
+        self.recolorChangedItems()
 
         return True
 
@@ -60,10 +60,13 @@ class ClusterSelector(QTreeView):
     def selectionChanged(self, selected: QItemSelection, deselected: QItemSelection):
         super().selectionChanged(selected, deselected)
         if self.clusterActions is not None:
-            self.clusterActions['merge'].setEnabled(self.model().canMerge(self.selectedIndexes()))
-            self.clusterActions['split'].setEnabled(self.model().canSplit(self.selectedIndexes()))
-            self.clusterActions['unassign'].setEnabled(self.model().canUnassign(self.selectedIndexes()))
-            self.clusterActions['restoreUnassigned'].setEnabled(self.model().canRestoreUnassigned())
+            model = self.model()
+            indices = self.selectedIndexes()
+            hasSelection = len(indices) > 0
+            self.clusterActions['merge'].setEnabled(hasSelection and model.canMerge(indices))
+            self.clusterActions['split'].setEnabled(hasSelection and model.canSplit(indices))
+            self.clusterActions['unassign'].setEnabled(hasSelection and model.canUnassign(indices))
+            self.clusterActions['restoreUnassigned'].setEnabled(model.canRestoreUnassigned())
 
     def mergeSelected(self):
         self.model().merge(self.selectedIndexes())
@@ -1,13 +1,21 @@
 from __future__ import annotations
+import functools
 import typing
 from PyQt6.QtGui import QColor
 
 _default_colors = ('red', 'green', 'darkblue', 'skyblue', 'magenta', 'gold', 'black')
+_default_qcolors = tuple(QColor(c) for c in _default_colors)
 
 
 def default_color(i: int):
-    i = i % len(_default_colors)
-    return QColor(_default_colors[i])
+    """Returns a shared QColor instance, copy it before modifying."""
+    return _default_qcolors[i % len(_default_qcolors)]
+
+
+@functools.lru_cache(maxsize=64)
+def _splitFractions(count: int) -> tuple[tuple[float, float], ...]:
+    """(start, end) fractions of each sub-range when splitting a range into count equal parts."""
+    return tuple((i / count, (i + 1) / count) for i in range(count))
 
 
 # noinspection PyPep8Naming
@@ -57,15 +65,15 @@ class ColorRange:
                 method = 'lightness'
 
         ranges = []
-        for i in range(count):
+        for t0, t1 in _splitFractions(count):
             if method in ('hue', 'h'):
-                hRange = (self._lerp(self._hRange, i / count), self._lerp(self._hRange, (i + 1) / count))
+                hRange = (self._lerp(self._hRange, t0), self._lerp(self._hRange, t1))
                 ranges.append(ColorRange(hRange, self._sRange, self._lRange))
             elif method in ('saturation', 's', 'sat'):
-                sRange = (self._lerp(self._sRange, i / count), self._lerp(self._sRange, (i + 1) / count))
+                sRange = (self._lerp(self._sRange, t0), self._lerp(self._sRange, t1))
                 ranges.append(ColorRange(self._hRange, sRange, self._lRange))
             elif method in ('lightness', 'l', 'light', 'li'):
-                lRange = (self._lerp(self._lRange, i / count), self._lerp(self._lRange, (i + 1) / count))
+                lRange = (self._lerp(self._lRange, t0), self._lerp(self._lRange, t1))
                 ranges.append(ColorRange(self._hRange, self._sRange, lRange))
         return ranges
 
@@ -1,6 +1,5 @@
 from pyqtgraph import ViewBox
 import weakref
-import pyqtgraph as pg
 
 
 # noinspection PyPep8Naming
@@ -10,24 +9,18 @@ def linkAxes(srcView: ViewBox, tgtView: ViewBox, srcAxis: int, tgtAxis: int, rec
     if not hasattr(tgtView, 'axisLinkSrc'):
         tgtView.axisLinkSrc = [None, None]
 
-    tgtView.axisLinkSlot[tgtAxis] = lambda _, value: _updateAxisFromLinkedView(srcView, tgtView, tgtAxis, value)
-
-    # Disconnect old
+    # Disconnect old, only the link's own slot so other connections to the signal are kept
     if tgtView.axisLinkSrc[tgtAxis] is not None:
         (oldSrcView, oldSrcAxis) = tgtView.axisLinkSrc[tgtAxis]
         oldSrcView = oldSrcView()
         if oldSrcView is not None:
             oldSignal = 'sigXRangeChanged' if oldSrcAxis == ViewBox.XAxis else 'sigYRangeChanged'
-            getattr(oldSrcView,
-                    oldSignal).disconnect()  # This diconnect everything, might conflict with native functionality
+            getattr(oldSrcView, oldSignal).disconnect(tgtView.axisLinkSlot[tgtAxis])
 
     # Connect new
-    if srcAxis == ViewBox.XAxis:
-        signal = 'sigXRangeChanged'
-    else:
-        signal = 'sigYRangeChanged'
-
-    getattr(srcView, signal).connect(tgtView.axisLinkSlot[tgtAxis])
+    tgtView.axisLinkSlot[tgtAxis] = _AxisLinker(srcView, tgtView, tgtAxis)
+    signal = srcView.sigXRangeChanged if srcAxis == ViewBox.XAxis else srcView.sigYRangeChanged
+    signal.connect(tgtView.axisLinkSlot[tgtAxis])
     tgtView.axisLinkSrc[tgtAxis] = (weakref.ref(srcView), srcAxis)
 
     if reciprocal:
@@ -35,15 +28,23 @@ def linkAxes(srcView: ViewBox, tgtView: ViewBox, srcAxis: int, tgtAxis: int, rec
 
 
 # noinspection PyPep8Naming
-def _updateAxisFromLinkedView(src: ViewBox, tgt: ViewBox, axis: int, value: tuple):
-    if tgt.linksBlocked:
-        return
-
-    src.blockLink(True)
-    try:
-        if axis == pg.ViewBox.XAxis:
-            tgt.setRange(xRange=value, padding=0, update=True)
-        elif axis == pg.ViewBox.YAxis:
-            tgt.setRange(yRange=value, padding=0, update=True)
-    finally:
-        src.blockLink(False)
+class _AxisLinker:
+    """Range changed slot. Holds weak references so the link does not keep either view alive."""
+    __slots__ = ('src', 'tgt', 'rangeKwarg')
+
+    def __init__(self, src: ViewBox, tgt: ViewBox, axis: int):
+        self.src = weakref.ref(src)
+        self.tgt = weakref.ref(tgt)
+        self.rangeKwarg = 'xRange' if axis == ViewBox.XAxis else 'yRange'
+
+    def __call__(self, _, value: tuple):
+        src = self.src()
+        tgt = self.tgt()
+        if src is None or tgt is None or tgt.linksBlocked:
+            return
+
+        src.blockLink(True)
+        try:
+            tgt.setRange(**{self.rangeKwarg: value}, padding=0, update=True)
+        finally:
+            src.blockLink(False)
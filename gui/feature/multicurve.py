@@ -7,18 +7,24 @@ import pyqtgraph as pg
 class MultiCurvePlotItem(QGraphicsPathItem):
     def __init__(self, x, y, c='w'):
         """
-        An alternative to pyqtgraph.PlotCurveItem, offers better performance when plotting multiple curves. x and y must be same shape (n_curves, n_samples_per_curve)
+        An alternative to pyqtgraph.PlotCurveItem, offers better performance when plotting multiple curves. x and y must be same shape (n_curves, n_samples_per_curve), or x can be shared by all curves.
 
-        :param x: x coords, numpy.ndarray with shape (n_curves, n_samples_per_curve)
+        :param x: x coords, numpy.ndarray with shape (n_curves, n_samples_per_curve), or (n_samples_per_curve,) if shared
         :param y: y coords, numpy.ndarray with shape (n_curves, n_samples_per_curve)
         :param c: colors, see pyqtgraph.mkPen
         """
-        connect = np.ones(y.shape, dtype=bool)
-        connect[:, -1] = False
-        self.path = pg.arrayToQPath(x.flatten(), y.flatten(), connect.flatten())
+        connect = MultiCurvePlotItem._connectMask(y.shape[0], y.shape[1])
+        x = np.tile(x, y.shape[0]) if np.ndim(x) == 1 else np.ravel(x)
+        self.path = pg.arrayToQPath(x, np.ravel(y), connect)
         super().__init__(self.path)
         self.setPen(pg.mkPen(c))
 
     def boundingRect(self):
         return self.path.boundingRect()
 
+    @staticmethod
+    def _connectMask(n_curves: int, n_samples: int) -> np.ndarray:
+        """Connect every sample to the next, except the last sample of each curve."""
+        connect = np.ones(n_curves * n_samples, dtype=bool)
+        connect[n_samples - 1::n_samples] = False
+        return connect
@@ -1,10 +1,10 @@
 import typing
 import numpy as np
 import pyqtgraph as pg
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QThread
 from PyQt6.QtWidgets import *
-from PyQt6.QtGui import QColor
-import gui
+from PyQt6.QtGui import QColor, QPen
+from gui.color import default_color
 from gui.feature.multicurve import MultiCurvePlotItem
 from spikedata import SpikeData
 from spikefeatures import SpikeFeatures
@@ -13,12 +13,21 @@ pg.setConfigOption('background', pg.mkColor(.9, .9, .9, .25))
 pg.setConfigOption('foreground', 'k')
 
 
-DATA_PEN = 0
-DATA_BRUSH = 1
+# Attributes on plot items that hold their (uncopied) pen/brush, for restyling. Plain python attributes, avoiding
+# QGraphicsItem.setData's QVariant round trip.
+DATA_PEN = 'dataPen'
+DATA_BRUSH = 'dataBrush'
+
+# Cache mode of plotted items. Items are then only re-rendered when they change, not when an overlay (ROI, cursor) moves
+# over them. Set to QGraphicsItem.CacheMode.NoCache if cached items render inconsistently at extreme zoom levels.
+ITEM_CACHE_MODE = QGraphicsItem.CacheMode.DeviceCoordinateCache
+
+_BLACK = QColor('black')  # Color of unselected spikes. Shared, do not modify.
 
 
 def plot_waveforms(spike_data: SpikeData, plt: pg.PlotItem, labels: np.ndarray = None,
-                   indices: list[np.ndarray] = None, selection: np.ndarray = None, colors: list[QColor] = None, mode='mean', yrange=None, prct=5):
+                   indices: list[np.ndarray] = None, selection: np.ndarray = None, colors: list[QColor] = None, mode='mean', yrange=None, prct=5,
+                   max_points_per_curve: int = None, block: bool = None, scaled: np.ndarray = None):
     """
     Plot waveforms from spike data.
 
@@ -28,6 +37,10 @@ def plot_waveforms(spike_data: SpikeData, plt: pg.PlotItem, labels: np.ndarray =
     :param mode: 'raw', 'mean', 'both'
     :param yrange: (min, max) or PlotWidget to copy range from
     :param prct: percentile (prct, 1-prct) to show in 'mean' mode. (0-50, default 5)
+    :param max_points_per_curve: (optional) in 'raw' mode, reduce longer waveforms to their min/max per time bin
+    :param block: when a new plot is created, run the event loop until it is closed. (default None blocks only if no
+        event loop is running yet)
+    :param scaled: (optional) scaled_waveforms(spike_data), for callers that keep it across replots
     :return:
     """
     app = _get_or_create_app()
@@ -35,17 +48,27 @@ def plot_waveforms(spike_data: SpikeData, plt: pg.PlotItem, labels: np.ndarray =
     plt.setLabel('left', text=f'amplitude ({spike_data.waveform_units})')
     plt.setLabel('bottom', text='time', units='s')
 
+    all_waveforms = scaled_waveforms(spike_data) if scaled is None else scaled
+    timestamps = spike_data.waveform_timestamps
+
     # TODO: implement selection mask for the first 2 "if" conditions.
     if labels is None and indices is None:
-        waveforms = spike_data.waveforms * spike_data.waveform_conversion_factor
-        items = [_plot_waveforms(plt, waveforms, spike_data.waveform_timestamps, color='k', mode=mode, prct=prct)]
+        waveforms = all_waveforms
+        items = [_plot_waveforms(plt, waveforms, timestamps, color='k', mode=mode, prct=prct,
+                                 max_points_per_curve=max_points_per_curve)]
     # TODO: implement selection mask for the first 2 "if" conditions.
     elif labels is not None:
         items = []
-        for i_cluster in range(np.max(labels)+1):
-            waveforms = spike_data.waveforms[labels == i_cluster] * spike_data.waveform_conversion_factor
-            itemsInCluster = _plot_waveforms(plt, waveforms=waveforms, timestamps=spike_data.waveform_timestamps,
-                                             color=gui.default_color(i_cluster), mode=mode, prct=prct)
+        order, offsets = _group_by_label(labels)
+        sorted_waveforms = all_waveforms[order]
+        for i_cluster in range(len(offsets) - 1):
+            if offsets[i_cluster] == offsets[i_cluster + 1]:
+                items.append([])
+                continue
+            waveforms = sorted_waveforms[offsets[i_cluster]:offsets[i_cluster + 1]]
+            itemsInCluster = _plot_waveforms(plt, waveforms=waveforms, timestamps=timestamps,
+                                             color=default_color(i_cluster), mode=mode, prct=prct,
+                                             max_points_per_curve=max_points_per_curve)
             items.append(itemsInCluster)
     elif indices is not None:
         items = []
@@ -53,12 +76,13 @@ def plot_waveforms(spike_data: SpikeData, plt: pg.PlotItem, labels: np.ndarray =
             if selection is None:
                 this_selection = indices[i_cluster]
             else:
-                this_selection = np.intersect1d(indices[i_cluster], np.where(selection))
+                this_selection = indices[i_cluster][selection[indices[i_cluster]]]
             if this_selection.size > 0:
-                waveforms = spike_data.waveforms[this_selection, :] * spike_data.waveform_conversion_factor
-                color = gui.default_color(i_cluster) if colors is None else colors[i_cluster]
-                itemsInCluster = _plot_waveforms(plt, waveforms=waveforms, timestamps=spike_data.waveform_timestamps,
-                                                 color=color, mode=mode, prct=prct)
+                waveforms = all_waveforms[this_selection, :]
+                color = default_color(i_cluster) if colors is None else colors[i_cluster]
+                itemsInCluster = _plot_waveforms(plt, waveforms=waveforms, timestamps=timestamps,
+                                                 color=color, mode=mode, prct=prct,
+                                                 max_points_per_curve=max_points_per_curve)
                 items.append(itemsInCluster)
             else:
                 items.append([])
@@ -82,69 +106,146 @@ def plot_waveforms(spike_data: SpikeData, plt: pg.PlotItem, labels: np.ndarray =
     plt.setMenuEnabled(False)
     plt.setAutoPan(x=False, y=False)
 
-    if make_new_plot:
-        app.exec_()
+    _show_new_plot(app, plt, layout, make_new_plot, block)
 
     return plt, items
 
 
+def scaled_waveforms(spike_data: SpikeData) -> np.ndarray:
+    """All waveforms converted to analog units, as float32."""
+    return np.multiply(spike_data.waveforms, np.float32(spike_data.waveform_conversion_factor), dtype=np.float32)
+
+
+def _group_by_label(labels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Group spikes by cluster label with a single sort.
+
+    :return: (order, offsets), spikes labelled i are order[offsets[i]:offsets[i+1]], in their original order
+    """
+    order = np.argsort(labels, kind='stable')
+    offsets = np.zeros(int(np.max(labels)) + 2, dtype=np.intp)
+    np.cumsum(np.bincount(labels), out=offsets[1:])
+    return order, offsets
+
+
+def _mean_sd(waveforms: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Column mean and (population) standard deviation, from sums and sums of squares accumulated in double precision,
+    returned in single precision. Unlike np.std, this does not compute the mean a second time, or allocate a centered copy of waveforms."""
+    n = waveforms.shape[0]
+    mean = waveforms.sum(axis=0, dtype=np.float64) / n
+    mean_sq = np.einsum('ij,ij->j', waveforms, waveforms, dtype=np.float64) / n
+    sd = np.sqrt(np.maximum(mean_sq - mean * mean, 0))
+    return mean.astype(np.float32), sd.astype(np.float32)
+
+
+def _peak_downsample(waveforms: np.ndarray, timestamps: np.ndarray,
+                     max_points: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce each waveform to its max and min within consecutive time bins, so peaks survive downsampling.
+
+    :return: (waveforms, timestamps) with at most max_points samples per waveform, or the inputs if already short enough
+    """
+    n_samples = waveforms.shape[1]
+    if n_samples <= max_points:
+        return waveforms, timestamps
+    stride = -(-n_samples // max(max_points // 2, 1))  # ceil, two output samples per bin
+    starts = np.arange(0, n_samples, stride)
+    ends = np.minimum(starts + stride, n_samples) - 1
+    peaks = np.empty((waveforms.shape[0], starts.size, 2), dtype=waveforms.dtype)
+    peaks[:, :, 0] = np.maximum.reduceat(waveforms, starts, axis=1)
+    peaks[:, :, 1] = np.minimum.reduceat(waveforms, starts, axis=1)
+    return peaks.reshape(waveforms.shape[0], -1), np.stack((timestamps[starts], timestamps[ends]), axis=-1).ravel()
+
+
 def _plot_waveforms(plt: pg.PlotItem, waveforms: np.ndarray, timestamps: np.ndarray, color='k',
-                    mode='raw', prct=5):
+                    mode='raw', prct=5, max_points_per_curve: int = None):
     """Plot waveforms in one color."""
+    # Single precision is plenty for plotting, and halves memory traffic of the reductions below. No-op for waveforms
+    # from scaled_waveforms. Timestamps are left as is, pyqtgraph builds paths in double precision anyway.
+    waveforms = np.ascontiguousarray(waveforms, dtype=np.float32)
     if mode == 'raw':
-        curves = MultiCurvePlotItem(x=np.tile(timestamps, reps=(waveforms.shape[0], 1)), y=waveforms,
-                                    c=color)
+        if max_points_per_curve is not None:
+            waveforms, timestamps = _peak_downsample(waveforms, timestamps, max_points_per_curve)
+        curves = MultiCurvePlotItem(x=timestamps, y=waveforms, c=color)
+        curves.setCacheMode(ITEM_CACHE_MODE)
         plt.addItem(curves)
         # plt.setTitle('waveforms (raw)')
         return [curves]
     elif mode == 'mean':
-        mean = waveforms.mean(axis=0)
-        sd = waveforms.std(axis=0)
-        prct_hi = np.percentile(waveforms, 100 - prct, axis=0)
-        prct_lo = np.percentile(waveforms, prct, axis=0)
-
-        color = pg.mkColor(color)
-        pen = pg.mkPen(color, width=2, style=Qt.PenStyle.SolidLine)
-        mean_curve = pg.PlotCurveItem(x=timestamps, y=mean, pen=pg.mkPen(color, width=2, style=Qt.PenStyle.SolidLine))
-        QGraphicsItem.setData(mean_curve, DATA_PEN, pen)
-
-        color.setAlphaF(0.25)
-        pen.setWidth(1)
-        pen.setStyle(Qt.PenStyle.DotLine)
-        sd_pos_curve = pg.PlotCurveItem(x=timestamps, y=mean + sd, pen=pen)
-        sd_neg_curve = pg.PlotCurveItem(x=timestamps, y=mean - sd, pen=pen)
-        QGraphicsItem.setData(sd_pos_curve, DATA_PEN, pen)
-        QGraphicsItem.setData(sd_neg_curve, DATA_PEN, pen)
-
-        pen.setStyle(Qt.PenStyle.DotLine)
-        prct_hi_curve = pg.PlotCurveItem(x=timestamps, y=prct_hi, pen=pen)
-        prct_lo_curve = pg.PlotCurveItem(x=timestamps, y=prct_lo, pen=pen)
-        QGraphicsItem.setData(prct_hi_curve, DATA_PEN, pen)
-        QGraphicsItem.setData(prct_lo_curve, DATA_PEN, pen)
-
-        color.setAlphaF(0.125)
-        brush = pg.mkBrush(color)
-        sd_fill = pg.FillBetweenItem(curve1=sd_pos_curve, curve2=sd_neg_curve, brush=brush)
-        prct_fill = pg.FillBetweenItem(curve1=prct_hi_curve, curve2=prct_lo_curve, brush=brush)
-        QGraphicsItem.setData(sd_fill, DATA_BRUSH, brush)
-        QGraphicsItem.setData(prct_fill, DATA_BRUSH, brush)
-
-        plt.addItem(mean_curve)
-        plt.addItem(sd_pos_curve)
-        plt.addItem(sd_neg_curve)
-        plt.addItem(prct_hi_curve)
-        plt.addItem(prct_lo_curve)
-        plt.addItem(sd_fill)
-        plt.addItem(prct_fill)
-        # plt.setTitle(f"waveforms (mean&#177;sd, {prct:d} - {100 - prct:d}% prct)")
-        return [mean_curve, sd_pos_curve, sd_neg_curve, prct_hi_curve, prct_lo_curve, sd_fill, prct_fill]
+        return plot_waveform_stats(plt, timestamps, waveform_stats(waveforms, prct), color)
     else:
         raise ValueError(f"Unrecognized plot mode '{mode}', expected 'raw', 'mean'")
 
 
+def waveform_stats(waveforms: np.ndarray, prct=5) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Summary statistics plotted in 'mean' mode. Pure NumPy, safe to call from a worker thread.
+
+    :param waveforms: (n_spikes, n_samples) float32 waveforms, at least one spike
+    :param prct: percentile (prct, 1-prct) (0-50, default 5)
+    :return: (mean, sd, prct_lo, prct_hi), each (n_samples, ) float32
+    """
+    mean, sd = _mean_sd(waveforms)
+    # Nearest-rank percentiles, from a single partition. No interpolation between neighbouring ranks.
+    n = waveforms.shape[0]
+    k_lo = int(round(prct / 100 * (n - 1)))
+    k_hi = n - 1 - k_lo
+    partitioned = np.partition(waveforms, (k_lo, k_hi), axis=0)
+    prct_lo, prct_hi = partitioned[k_lo], partitioned[k_hi]
+    return mean, sd, prct_lo, prct_hi
+
+
+def plot_waveform_stats(plt: pg.PlotItem, timestamps: np.ndarray,
+                        stats: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], color='k') -> list[QGraphicsItem]:
+    """Plot the mean, mean +/- sd and percentile curves (and fills in between) from waveform_stats in one color."""
+    mean, sd, prct_lo, prct_hi = stats
+    # One color and style object per line type, shared by every item drawn with it
+    color = pg.mkColor(color)
+    dot_color = QColor(color)
+    dot_color.setAlphaF(0.25)
+    fill_color = QColor(color)
+    fill_color.setAlphaF(0.125)
+
+    pen = pg.mkPen(color, width=2, style=Qt.PenStyle.SolidLine)
+    mean_curve = pg.PlotCurveItem(x=timestamps, y=mean, pen=pen)
+    setattr(mean_curve, DATA_PEN, pen)
+
+    dot_pen = QPen(pen)
+    dot_pen.setColor(dot_color)
+    dot_pen.setWidth(1)
+    dot_pen.setStyle(Qt.PenStyle.DotLine)
+    sd_pos_curve = pg.PlotCurveItem(x=timestamps, y=mean + sd, pen=dot_pen)
+    sd_neg_curve = pg.PlotCurveItem(x=timestamps, y=mean - sd, pen=dot_pen)
+    prct_hi_curve = pg.PlotCurveItem(x=timestamps, y=prct_hi, pen=dot_pen)
+    prct_lo_curve = pg.PlotCurveItem(x=timestamps, y=prct_lo, pen=dot_pen)
+    for curve in (sd_pos_curve, sd_neg_curve, prct_hi_curve, prct_lo_curve):
+        setattr(curve, DATA_PEN, dot_pen)
+
+    brush = pg.mkBrush(fill_color)
+    sd_fill = pg.FillBetweenItem(curve1=sd_pos_curve, curve2=sd_neg_curve, brush=brush)
+    prct_fill = pg.FillBetweenItem(curve1=prct_hi_curve, curve2=prct_lo_curve, brush=brush)
+    setattr(sd_fill, DATA_BRUSH, brush)
+    setattr(prct_fill, DATA_BRUSH, brush)
+
+    items = [mean_curve, sd_pos_curve, sd_neg_curve, prct_hi_curve, prct_lo_curve, sd_fill, prct_fill]
+    for item in items:
+        item.setCacheMode(ITEM_CACHE_MODE)
+        plt.addItem(item)
+    return items
+
+
 def plot_features(spike_features: SpikeFeatures, plt: pg.PlotItem, labels: np.ndarray = None,
                   indices: list[np.ndarray] = None, selection: np.ndarray = None, colors: list[QColor] = None,
-                  dims: typing.Union[tuple, list, str] = 'xy'):
+                  dims: typing.Union[tuple, list, str] = 'xy', block: bool = None):
+    """
+    Plot 2 feature dimensions as a scatter plot.
+
+    :param block: when a new plot is created, run the event loop until it is closed. (default None blocks only if no
+        event loop is running yet)
+
+    :return: plt, and a list of plot items for each cluster. With labels, the list instead holds a single entry: one
+        scatter item for all clusters, colored per point. Restyling, hiding or removing it affects every cluster.
+    """
     app = _get_or_create_app()
     plt, layout, make_new_plot = _validate_or_create_plot(plt)
 
@@ -179,46 +280,55 @@ def plot_features(spike_features: SpikeFeatures, plt: pg.PlotItem, labels: np.nd
             if dims[i] >= spike_features.ndims or dims[i] < 0:
                 raise ValueError(f"dims[{i}] = {dims[i]} exceeds feature space dimensions [0, {spike_features.ndims}]")
 
+    all_features = spike_features.features
     items = []
     # TODO: implement selection mask for the first 2 "if" conditions.
     if labels is None and indices is None:
-        features = spike_features.features[:, dims]
+        features = all_features[:, dims]
         color = pg.mkColor('k')
         scatter = pg.ScatterPlotItem(pos=features, pen=pg.mkPen(color), brush=pg.mkBrush(color), size=2)
         plt.addItem(scatter)
         items.append([scatter])
     # TODO: implement selection mask for the first 2 "if" conditions.
     elif labels is not None:
-        for i_cluster in range(np.max(labels)+1):
-            features = spike_features.features[labels == i_cluster, :][:, dims]
-            color = gui.default_color(i_cluster)
-            scatter = _plot_features_single_cluster(features, color, plt)
-            items.append([scatter])
+        # One scatter item for all clusters, colored per point. Each cluster shares one pen/brush object.
+        n_clusters = int(np.max(labels)) + 1
+        pens = np.empty(n_clusters, dtype=object)
+        brushes = np.empty(n_clusters, dtype=object)
+        for i_cluster in range(n_clusters):
+            color = default_color(i_cluster)
+            pens[i_cluster] = pg.mkPen(color)
+            brushes[i_cluster] = pg.mkBrush(color)
+        scatter = pg.ScatterPlotItem(pos=all_features[:, dims], pen=pens[labels], brush=brushes[labels], size=2)
+        scatter.setCacheMode(ITEM_CACHE_MODE)
+        plt.addItem(scatter)
+        items.append([scatter])
     elif indices is not None:
         for i_cluster in range(len(indices)):
             if selection is None:
                 this_selection = indices[i_cluster]
-                features = spike_features.features[this_selection, :][:, dims]
+                features = all_features[this_selection, :][:, dims]
                 color = colors[i_cluster]
                 scatter = _plot_features_single_cluster(features, color, plt)
                 items.append([scatter])
             else:
-                this_selection = np.intersect1d(indices[i_cluster], np.where(selection))
-                this_not_selected = np.intersect1d(indices[i_cluster], np.where(np.invert(selection)))
+                cluster_indices = indices[i_cluster]
+                is_selected = selection[cluster_indices]
+                this_selection = cluster_indices[is_selected]
+                this_not_selected = cluster_indices[~is_selected]
                 this_items = []
                 if this_selection.size > 0:
-                    scatter_selected = _plot_features_single_cluster(spike_features.features[this_selection, :][:, dims], colors[i_cluster], plt)
+                    scatter_selected = _plot_features_single_cluster(all_features[this_selection, :][:, dims], colors[i_cluster], plt)
                     this_items.append(scatter_selected)
                 if this_not_selected.size > 0:
-                    scatter_not_selected = _plot_features_single_cluster(spike_features.features[this_not_selected, :][:, dims], QColor('black'), plt)
+                    scatter_not_selected = _plot_features_single_cluster(all_features[this_not_selected, :][:, dims], _BLACK, plt)
                     this_items.append(scatter_not_selected)
                 items.append(this_items)
 
     plt.setLabel('bottom', xlabel)
     plt.setLabel('left', ylabel)
 
-    if make_new_plot:
-        app.exec_()
+    _show_new_plot(app, plt, layout, make_new_plot, block)
 
     return plt, items
 
@@ -227,8 +337,9 @@ def _plot_features_single_cluster(features, color, plt):
     pen = pg.mkPen(color)
     brush = pg.mkBrush(color)
     scatter = pg.ScatterPlotItem(pos=features, pen=pen, brush=brush, size=2)
-    QGraphicsItem.setData(scatter, DATA_PEN, pen)
-    QGraphicsItem.setData(scatter, DATA_BRUSH, brush)
+    scatter.setCacheMode(ITEM_CACHE_MODE)
+    setattr(scatter, DATA_PEN, pen)
+    setattr(scatter, DATA_BRUSH, brush)
     plt.addItem(scatter)
 
     return scatter
@@ -242,6 +353,21 @@ def _get_or_create_app():
     return app
 
 
+def _show_new_plot(app: QApplication, plt: pg.PlotItem, layout: pg.GraphicsLayoutWidget, make_new_plot: bool,
+                   block: bool = None):
+    if not make_new_plot:
+        return
+    if block is None:
+        # Re-entering exec() from a running event loop (scripts in an IPython/Qt console, or the GUI itself) would
+        # block the caller until the new window is closed.
+        block = QThread.currentThread().loopLevel() == 0
+    if block:
+        app.exec()
+    else:
+        # The window is otherwise only referenced by this function, keep it alive for as long as the plot is.
+        plt.layoutWidget = layout
+
+
 def _validate_or_create_plot(plt: pg.PlotItem = None):
     make_new_plot = plt is None
     if make_new_plot:
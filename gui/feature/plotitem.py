@@ -6,8 +6,11 @@ from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import *
 from PyQt6.QtGui import QColor, QBrush, QPen
 from gui.cluster import ClusterItem
+from gui.feature.plot import ITEM_CACHE_MODE
 from abc import ABC, abstractmethod
 
+_BLACK = QColor('black')  # Color of unselected spikes. Shared, do not modify.
+
 
 # noinspection PyPep8Naming
 class FeaturePlotItem(pg.ScatterPlotItem):
@@ -17,6 +20,8 @@ class FeaturePlotItem(pg.ScatterPlotItem):
     features: np.ndarray  # (n_spikes, n_dims)
     pen: np.ndarray
     brush: np.ndarray
+    positions: np.ndarray  # (n_spikes_in_cluster, 2), all points, including those hidden by level of detail
+    _lod: np.ndarray = None  # Indices into positions that are plotted, None if all are
     _dims: tuple[int, int]
 
     def __init__(self, features: np.ndarray, cluster: ClusterItem = None, selectionMask: np.ndarray = None, dims: typing.Union[str, tuple[int, int]] = (0, 1)):
@@ -25,7 +30,10 @@ class FeaturePlotItem(pg.ScatterPlotItem):
         self._localSelectionMask = selectionMask[cluster.indices] if selectionMask is not None else None
         self.features = features
         self.dims = dims
-        pg.ScatterPlotItem.__init__(self, pos=features[cluster.indices, :][:, self.dims], size=2)
+        self.positions = features[cluster.indices, :][:, self.dims]
+        pg.ScatterPlotItem.__init__(self, pos=self.positions, size=2)
+        # Blit a cached pixmap when only overlays (e.g. the ROI) change. Restyling calls update(), which invalidates it.
+        self.setCacheMode(ITEM_CACHE_MODE)
         self.pen = None
         self.brush = None
         self.setSelectionMask(selectionMask)
@@ -70,8 +78,39 @@ class FeaturePlotItem(pg.ScatterPlotItem):
     def onSelectionMaskChanged(self, globalMask: np.ndarray, localMask: np.ndarray):
         self.pen = self.createPens()
         self.brush = self.createBrushes()
-        self.setPen(self.pen)
-        self.setBrush(self.brush)
+        self._applyStyles()
+
+    def _applyStyles(self):
+        """Set pens/brushes of plotted points (see setLevelOfDetail)."""
+        if self._lod is not None and isinstance(self.pen, np.ndarray):
+            self.setPen(self.pen[self._lod])
+            self.setBrush(self.brush[self._lod])
+        else:
+            self.setPen(self.pen)
+            self.setBrush(self.brush)
+
+    def setLevelOfDetail(self, pixelSize: tuple[float, float]):
+        """
+        Plot at most one point per screen pixel, overlapping points are not drawn. The pixel grid is snapped to powers
+        of 2, so small view changes do not change the plotted points.
+
+        :param pixelSize: (width, height) of a screen pixel in data coordinates, see ViewBox.viewPixelSize()
+        """
+        if not all(np.isfinite(pixelSize)) or min(pixelSize) <= 0:
+            return
+        cellSize = np.exp2(np.floor(np.log2(pixelSize)))
+        cells = np.floor(self.positions / cellSize).clip(-2**30, 2**30 - 1).astype(np.int64) + 2**30
+        _, lod = np.unique(cells[:, 0] * 2**31 + cells[:, 1], return_index=True)
+        if lod.size == self.positions.shape[0]:
+            lod = None
+        else:
+            lod.sort()  # Keep drawing order
+
+        if lod is None and self._lod is None or lod is not None and self._lod is not None and np.array_equal(lod, self._lod):
+            return
+        self._lod = lod
+        self.setData(pos=self.positions if lod is None else self.positions[lod])
+        self._applyStyles()
 
     def createPens(self) -> np.ndarray:
         return self._createStyles(QPen, pg.mkPen, self.pen)
@@ -83,14 +122,18 @@ class FeaturePlotItem(pg.ScatterPlotItem):
         if self.localSelectionMask is None:
             return method(self.cluster.color)
 
+        # One shared style object per state, the array only holds references to them
+        selected = np.array(method(self.cluster.color), dtype=dtype)
+        unselected = np.array(method(_BLACK), dtype=dtype)
+
         # Create array, or validate array size
         size = self.cluster.size
-        if array is None:
-            array = np.empty((size,), dtype=dtype)
+        if not isinstance(array, np.ndarray):
+            return np.where(self.localSelectionMask, selected, unselected)
         elif array.shape != (size, ):
             raise ValueError(f"Provided array has shape {array.shape}, does not match required shape {(size,)}")
 
-        array[self.localSelectionMask] = method(self.cluster.color)
-        array[np.invert(self.localSelectionMask)] = method(QColor('black'))
+        np.copyto(array, unselected)
+        np.copyto(array, selected, where=self.localSelectionMask)
 
         return array
@@ -1,10 +1,11 @@
+from __future__ import annotations
+import threading
 import numpy as np
 from PyQt6.QtCore import Qt, QPointF, QRectF
 from PyQt6.QtGui import QPainterPath, QPainter
 import pyqtgraph as pg
 from pyqtgraph.GraphicsScene.mouseEvents import MouseClickEvent
 from pyqtgraph.graphicsItems.ROI import ROI, Handle, Point
-from matplotlib import path
 
 # noinspection PyPep8Naming
 class PolygonROI(ROI):
@@ -15,6 +16,8 @@ class PolygonROI(ROI):
     _scene: pg.GraphicsScene = None
     _menuEnabled = True
     _completed = False
+    _edges: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None
+    _bounds: tuple[float, float, float, float] = None
 
     def __init__(self, positions, scene: pg.GraphicsScene, **args):
         super(PolygonROI, self).__init__([0, 0], [1, 1], movable=False, removable=False, **args)
@@ -60,7 +63,6 @@ class PolygonROI(ROI):
             pos = self.getViewBox().mapSceneToView(ev.scenePos())
             self.addFreeHandle(pos)
         elif ev.button() == Qt.MouseButton.RightButton and len(self.handles) > 1:
-            print(len(self.handles), '\n', *self.handles)
             ev.accept()
             self.removeHandle(self.handles[-1]['item'])
             self.moveLastPoint(ev.scenePos())
@@ -90,10 +92,106 @@ class PolygonROI(ROI):
     def completed(self) -> bool:
         return self._completed
 
-    def contains_points(self, points: np.ndarray) -> np.ndarray:
+    def stateChanged(self, finish=True):
+        # Handles were added, removed or moved
+        self._edges = None
+        self._bounds = None
+        super().stateChanged(finish=finish)
+
+    def edges(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Non-horizontal polygon edges (see _polygon_edges), cached until the ROI changes."""
+        if self._edges is None:
+            self._updatePolygon()
+        return self._edges
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        """Polygon bounding box (xmin, xmax, ymin, ymax), cached until the ROI changes."""
+        if self._bounds is None:
+            self._updatePolygon()
+        return self._bounds
+
+    def _updatePolygon(self):
+        n = len(self.handles)
+        vx = np.fromiter((hInfo['pos'].x() for hInfo in self.handles), dtype=np.float64, count=n)
+        vy = np.fromiter((hInfo['pos'].y() for hInfo in self.handles), dtype=np.float64, count=n)
+        self._edges = _polygon_edges(vx, vy)
+        self._bounds = (vx.min(), vx.max(), vy.min(), vy.max())
+
+    def contains_points(self, points: np.ndarray, sorted_by_y=False) -> np.ndarray:
         """
+        :param points: (n_points, 2) array of (x, y) coordinates
+        :param sorted_by_y: if True, points must be sorted by ascending y. Each polygon edge is then only tested against
+            the points within its y range, which is faster when the same points are tested repeatedly.
         :return: NumPy array of bool values, indicating whether each index is selected.
         """
-        p = path.Path([(hInfo['pos'].x(), hInfo['pos'].y()) for hInfo in self.handles])
-        return p.contains_points(points)
+        xs = points[:, 0]
+        ys = points[:, 1]
+
+        if sorted_by_y:
+            return contains_sorted_points(xs, ys, self.edges(), np.empty(points.shape[0], dtype=bool))
+
+        # Only points inside the bounding box need the full crossing test
+        xmin, xmax, ymin, ymax = self.bounds()
+        candidates = np.flatnonzero((xs >= xmin) & (xs <= xmax) & (ys >= ymin) & (ys <= ymax))
 
+        selection = np.zeros(points.shape[0], dtype=bool)
+        selection[candidates] = _contains_points(xs[candidates], ys[candidates], self.edges(),
+                                                 np.empty(candidates.size, dtype=bool))
+        return selection
+
+
+def _polygon_edges(vx: np.ndarray, vy: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Edges between consecutive vertices (and last to first), skipping horizontal edges, which are never crossed.
+
+    :return: (y_lo, y_hi, slope, intercept), each (n_edges, ). Edge k spans y_lo[k] <= y < y_hi[k], along the line
+        x = y * slope[k] + intercept[k].
+    """
+    vx_next = np.roll(vx, -1)
+    vy_next = np.roll(vy, -1)
+    keep = vy != vy_next
+    x0, y0, x1, y1 = vx[keep], vy[keep], vx_next[keep], vy_next[keep]
+    slope = (x1 - x0) / (y1 - y0)
+    intercept = x0 - y0 * slope
+    return np.minimum(y0, y1), np.maximum(y0, y1), slope, intercept
+
+
+def _contains_points(xs: np.ndarray, ys: np.ndarray, edges: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+                     out: np.ndarray) -> np.ndarray:
+    """
+    Crossing number point-in-polygon test. A point is inside if a ray cast from it towards +x crosses an odd number of
+    polygon edges. Loops over edges, each edge is tested against all points at once.
+
+    :param xs, ys: point coordinates, (n_points, )
+    :param edges: polygon edges, see _polygon_edges
+    :param out: (n_points, ) bool array to write results to
+    :return: out
+    """
+    out[:] = False
+    for y_lo, y_hi, slope, intercept in zip(*edges):
+        crosses = ys >= y_lo
+        crosses &= ys < y_hi
+        crosses &= xs < ys * slope + intercept
+        out ^= crosses
+    return out
+
+
+def contains_sorted_points(xs: np.ndarray, ys: np.ndarray, edges: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+                           out: np.ndarray, cancel: threading.Event = None) -> np.ndarray | None:
+    """
+    Same as _contains_points, for points sorted by ascending y. The points within an edge's y range are a contiguous
+    slice of the sorted points, found by binary search. Safe to call from a worker thread, as long as edges are taken
+    from PolygonROI.edges() beforehand.
+
+    :param cancel: (optional) checked between edges, returns None once it is set
+    """
+    out[:] = False
+    y_lo, y_hi, slope, intercept = edges
+    lo = np.searchsorted(ys, y_lo, side='left')
+    hi = np.searchsorted(ys, y_hi, side='left')
+    for k in range(len(slope)):
+        if cancel is not None and cancel.is_set():
+            return None
+        if lo[k] < hi[k]:
+            out[lo[k]:hi[k]] ^= xs[lo[k]:hi[k]] < ys[lo[k]:hi[k]] * slope[k] + intercept[k]
+    return out
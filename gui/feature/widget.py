@@ -1,13 +1,15 @@
 from __future__ import annotations
 
+import threading
 import numpy as np
 from PyQt6.QtGui import QPen, QKeyEvent
-from PyQt6.QtCore import pyqtSignal
+from PyQt6.QtCore import pyqtSignal, QTimer, QThreadPool, QRunnable
 from pyqtgraph.GraphicsScene.mouseEvents import MouseClickEvent
 
 from .linkaxes import linkAxes
 from .plot import *
-from .roi import PolygonROI
+from .plotitem import FeaturePlotItem
+from .roi import PolygonROI, contains_sorted_points
 from ..cluster.item import ClusterItem
 
 
@@ -18,13 +20,20 @@ class FeaturesPlot(QWidget):
     xzPlot: pg.PlotItem
     yzPlot: pg.PlotItem
     plotItems: dict[ClusterItem, list[QGraphicsItem]]
+    waveformItems: dict[ClusterItem, list[QGraphicsItem]]  # Subset of plotItems in waveformPlot
     data: SpikeData = None
     features: SpikeFeatures = None
+    _scaledWaveforms: np.ndarray = None  # scaled_waveforms(data), computed once per load
     roi: PolygonROI = None
     selection: np.ndarray = None
     selectionChanged = pyqtSignal(np.ndarray)
+    _roiSelectionReady = pyqtSignal(np.ndarray, object)  # (selection, cancel event), emitted from worker threads
+    _waveformStatsReady = pyqtSignal(object, object, object)  # (clusters, stats, cancel event), from worker threads
+    _roiTaskCancel: threading.Event = None
+    _waveformTaskCancel: threading.Event = None
 
     _cachedClusters: set[ClusterItem] = None
+    _projections: dict[pg.ViewBox, tuple[np.ndarray, np.ndarray]] = None
 
     def cacheClusters(self, clusters: typing.Iterable[ClusterItem]):
         if self._cachedClusters is not None:
@@ -39,11 +48,40 @@ class FeaturesPlot(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.plotItems = {}
+        self.waveformItems = {}
         self.createPlots()
 
+        # Coalesce selection changes into a single plot update, restarted on each change
+        self._selectionTimer = QTimer(self)
+        self._selectionTimer.setSingleShot(True)
+        self._selectionTimer.setInterval(16)
+        self._selectionTimer.timeout.connect(self._updateSelection)
+        self._roiSelectionReady.connect(self._onROISelectionReady)
+        self._waveformStatsReady.connect(self._onWaveformStatsReady)
+
+        # Update level of detail of feature plots after zooming/panning
+        self._levelOfDetailTimer = QTimer(self)
+        self._levelOfDetailTimer.setSingleShot(True)
+        self._levelOfDetailTimer.setInterval(50)
+        self._levelOfDetailTimer.timeout.connect(self._updateLevelOfDetail)
+        for plt in (self.xyPlot, self.xzPlot, self.yzPlot):
+            plt.getViewBox().sigRangeChanged.connect(self._levelOfDetailTimer.start)
+
     def load(self, data: SpikeData, features: SpikeFeatures):
+        # Results of running tasks belong to the previous data
+        self._cancelROITask()
+        self._cancelWaveformTask()
         self.data = data
         self.features = features
+        self._scaledWaveforms = scaled_waveforms(data) if data is not None else None
+
+        # 2D feature projections shown in each view, for selecting points from an ROI. Points are sorted by y, together
+        # with the order that sorts them, so that each ROI edge only needs to be tested against a slice of points.
+        self._projections = {}
+        if features is not None:
+            for plt, dims in ((self.xyPlot, (0, 1)), (self.xzPlot, (0, 2)), (self.yzPlot, (1, 2))):
+                order = np.argsort(features.features[:, dims[1]], kind='stable')
+                self._projections[plt.getViewBox()] = (features.features[order][:, dims], order)
 
     def createPlots(self):
         """Make child plot widgets in QGridLayout"""
@@ -78,6 +116,12 @@ class FeaturesPlot(QWidget):
         xzScene.sigMouseClicked.connect(self.onPlotClicked)
         yzScene.sigMouseClicked.connect(self.onPlotClicked)
 
+        # ROI handles move on every mouse move while drawing/editing, and mean waveforms are replaced on every selection
+        # change, which keeps a BSP index busy re-indexing. These scenes only have a few (large) items, so a linear scan
+        # is cheaper.
+        for scene in (self.waveformPlot.scene(), xyScene, xzScene, yzScene):
+            scene.setItemIndexMethod(QGraphicsScene.ItemIndexMethod.NoIndex)
+
         self.setLayout(layout)
 
     def clear(self):
@@ -85,33 +129,31 @@ class FeaturesPlot(QWidget):
         self.xyPlot.clear()
         self.xzPlot.clear()
         self.yzPlot.clear()
+        self.plotItems.clear()
+        self.waveformItems.clear()
+        self._cancelROITask()
+        self._cancelWaveformTask()
 
     def plot(self, clusters: typing.Sequence[ClusterItem], selection: np.ndarray = None, data: SpikeData = None, features: SpikeFeatures = None):
         data = self.data if data is None else data
         features = self.features if features is None else features
 
-        indices = [cluster.indices for cluster in clusters]
-        colors = [cluster.color for cluster in clusters]
+        clusters = list(clusters)
 
         # Make a list of lists (one per cluster) to append plot items to.
-        plotItemsList = [self.plotItems[cluster] if cluster in self.plotItems else [] for cluster in clusters]
+        plotItemsList = [self.plotItems.get(cluster, []) for cluster in clusters]
 
         if data is not None:
-            _, waveformItems = plot_waveforms(data, indices=indices, selection=selection, colors=colors, plt=self.waveformPlot, mode='mean')
-            self.autoRange(features=False, waveforms=True)
-            for i in range(len(plotItemsList)):
-                plotItemsList[i].extend(waveformItems[i])
-            # self.plotItems.update(zip(spikeClusters, waveformItems))
+            self._plotWaveforms(clusters, plotItemsList, selection, data)
         if features is not None:
-            from .plotitem import FeaturePlotItem
-            for i in range(len(clusters)):
-                xyItem = FeaturePlotItem(features.features, cluster=clusters[i], selectionMask=selection, dims='xy')
-                xzItem = FeaturePlotItem(features.features, cluster=clusters[i], selectionMask=selection, dims='xz')
-                yzItem = FeaturePlotItem(features.features, cluster=clusters[i], selectionMask=selection, dims='yz')
+            for cluster, plotItems in zip(clusters, plotItemsList):
+                xyItem = FeaturePlotItem(features.features, cluster=cluster, selectionMask=selection, dims='xy')
+                xzItem = FeaturePlotItem(features.features, cluster=cluster, selectionMask=selection, dims='xz')
+                yzItem = FeaturePlotItem(features.features, cluster=cluster, selectionMask=selection, dims='yz')
                 self.xyPlot.addItem(xyItem)
                 self.xzPlot.addItem(xzItem)
                 self.yzPlot.addItem(yzItem)
-                plotItemsList[i].extend((xyItem, xzItem, yzItem))
+                plotItems.extend((xyItem, xzItem, yzItem))
             self.autoRange(features=True, waveforms=False)
             # _, xyItems = plot_features(features, dims='xy', indices=indices, selection=selection, colors=colors, plt=self.xyPlot)
             # _, xzItems = plot_features(features, dims='xz', indices=indices, selection=selection, colors=colors, plt=self.xzPlot)
@@ -128,28 +170,54 @@ class FeaturesPlot(QWidget):
         # Set visibility
         self.onVisibilityChanged(clusters)
 
+    def _plotWaveforms(self, clusters: list[ClusterItem], plotItemsList: list[list[QGraphicsItem]], selection: np.ndarray, data: SpikeData):
+        """Plot mean waveforms of (selected spikes in) each cluster, appending new items to plotItemsList."""
+        if not clusters:
+            return
+        indices, colors = zip(*[(cluster.indices, cluster.color) for cluster in clusters])
+        scaled = self._scaledWaveforms if data is self.data else None
+        _, waveformItems = plot_waveforms(data, indices=indices, selection=selection, colors=colors, plt=self.waveformPlot,
+                                          mode='mean', scaled=scaled)
+        self.autoRange(features=False, waveforms=True)
+        for cluster, plotItems, items in zip(clusters, plotItemsList, waveformItems):
+            plotItems.extend(items)
+            self.waveformItems[cluster] = items
+
+    def _updateLevelOfDetail(self):
+        for plt in (self.xyPlot, self.xzPlot, self.yzPlot):
+            pixelSize = plt.getViewBox().viewPixelSize()
+            for item in plt.items:
+                if isinstance(item, FeaturePlotItem):
+                    item.setLevelOfDetail(pixelSize)
+
     def onVisibilityChanged(self, clusters: typing.Iterable[ClusterItem]):
         for cluster in clusters:
-            if cluster in self.plotItems:
-                for item in self.plotItems[cluster]:
-                    item.setVisible(cluster.visible)
+            items = self.plotItems.get(cluster)
+            if items is None:
+                continue
+            visible = cluster.visible
+            for item in items:
+                item.setVisible(visible)
 
     def onColorChanged(self, clusters: typing.Iterable[ClusterItem]):
         """Change color but keep alpha."""
         for cluster in clusters:
-            if cluster in self.plotItems:
-                for item in self.plotItems[cluster]:
-                    pen = QGraphicsObject.data(item, DATA_PEN)
-                    brush = QGraphicsObject.data(item, DATA_BRUSH)
-                    color = cluster.color
-                    if pen is not None:
-                        color.setAlpha(pen.color().alpha())
-                        pen.setColor(color)
-                        item.setPen(pen)
-                    if brush is not None:
-                        color.setAlpha(brush.color().alpha())
-                        brush.setColor(color)
-                        item.setBrush(brush)
+            items = self.plotItems.get(cluster)
+            if items is None:
+                continue
+            clusterColor = cluster.color
+            for item in items:
+                pen = getattr(item, DATA_PEN, None)
+                brush = getattr(item, DATA_BRUSH, None)
+                color = QColor(clusterColor)  # Copy, cluster colors are shared
+                if pen is not None:
+                    color.setAlpha(pen.color().alpha())
+                    pen.setColor(color)
+                    item.setPen(pen)
+                if brush is not None:
+                    color.setAlpha(brush.color().alpha())
+                    brush.setColor(color)
+                    item.setBrush(brush)
 
     def onClustersAdded(self, clusters: typing.Iterable[ClusterItem]):
         # Only plot leaf items if tree nodes are given
@@ -161,14 +229,17 @@ class FeaturesPlot(QWidget):
     def onClustersRemoved(self, clusters: typing.Iterable[ClusterItem]):
         # print(f'Removing {len(clusters)} from plot:', *[c.name for c in clusters])
         self.uncacheClusters(clusters)
+        # Each plot has its own scene, remove items only from the plot they were added to
+        plotsByScene = {plt.scene(): plt for plt in (self.waveformPlot, self.xyPlot, self.xzPlot, self.yzPlot)}
         for cluster in clusters:
-            if cluster in self.plotItems:
-                for item in self.plotItems[cluster]:
-                    self.waveformPlot.removeItem(item)
-                    self.xyPlot.removeItem(item)
-                    self.xzPlot.removeItem(item)
-                    self.yzPlot.removeItem(item)
-                del self.plotItems[cluster]
+            items = self.plotItems.pop(cluster, None)
+            if items is None:
+                continue
+            for item in items:
+                plt = plotsByScene.get(item.scene())
+                if plt is not None:
+                    plt.removeItem(item)
+            self.waveformItems.pop(cluster, None)
 
     def autoRange(self, features=True, waveforms=True):
         if features:
@@ -203,32 +274,83 @@ class FeaturesPlot(QWidget):
 
     def selectFromROI(self, roi: PolygonROI):
         if roi is not None:
-            if roi.getViewBox() is self.xyPlot.getViewBox():
-                points = self.features.features[:, (0, 1)]
-            elif roi.getViewBox() is self.xzPlot.getViewBox():
-                points = self.features.features[:, (0, 2)]
-            elif roi.getViewBox() is self.yzPlot.getViewBox():
-                points = self.features.features[:, (1, 2)]
-            else:
+            projection = self._projections.get(roi.getViewBox())
+            if projection is None:
                 raise RuntimeError(f"ROI has invalid viewbox {roi.getViewBox()}.")
-            selection = roi.contains_points(points)
+            sortedPoints, order = projection
+
+            # Run the containment test in the background, cancelling the previous one if it is still running
+            self._cancelROITask()
+            self._roiTaskCancel = threading.Event()
+            task = _SelectFromROITask(roi.edges(), sortedPoints, order, self._roiTaskCancel, self._roiSelectionReady)
+            QThreadPool.globalInstance().start(task)
+
+    def _onROISelectionReady(self, selection: np.ndarray, cancel: threading.Event):
+        # Drop results from tasks that were superseded while their result was queued
+        if cancel is self._roiTaskCancel and not cancel.is_set():
+            self._roiTaskCancel = None
             self.onSelectionChanged(selection)
 
-    _plotRefreshInterval = 1/120 * 10e9
-    _lastPlotRefresh = 0
-
     def onSelectionChanged(self, selection: np.ndarray):
+        """Store selection, plots are updated once after a burst of changes (see _updateSelection)."""
         self.selection = selection
-
-        # Update plots
-        import time
-        t = time.time_ns()
-        if t - self._lastPlotRefresh > self._plotRefreshInterval:
-            self._lastPlotRefresh = t
-            # TODO: Recolor, rather than redoing the entire plot
-            self.clear()
-            self.plot(clusters=self._cachedClusters, selection=self.selection)
-            self.selectionChanged.emit(selection)
+        self._selectionTimer.start()
+
+    def _updateSelection(self):
+        selection = self.selection
+
+        # Recolor feature scatter plots in place
+        for items in self.plotItems.values():
+            for item in items:
+                if isinstance(item, FeaturePlotItem):
+                    item.setSelectionMask(selection)
+
+        # Mean waveforms depend on which spikes are selected. Their statistics are computed in the background, the
+        # current waveforms stay on screen until they are replaced (see _onWaveformStatsReady).
+        if self.data is not None:
+            self._cancelWaveformTask()
+            self._waveformTaskCancel = threading.Event()
+            clusters = list(self.plotItems.keys())
+            task = _WaveformStatsTask(clusters, [cluster.indices for cluster in clusters], selection,
+                                      self._scaledWaveforms, self._waveformTaskCancel, self._waveformStatsReady)
+            QThreadPool.globalInstance().start(task)
+
+        self.selectionChanged.emit(selection)
+
+    def _cancelROITask(self):
+        if self._roiTaskCancel is not None:
+            self._roiTaskCancel.set()
+            self._roiTaskCancel = None
+
+    def _cancelWaveformTask(self):
+        if self._waveformTaskCancel is not None:
+            self._waveformTaskCancel.set()
+            self._waveformTaskCancel = None
+
+    def _onWaveformStatsReady(self, clusters: list[ClusterItem], stats: list, cancel: threading.Event):
+        # Drop results from tasks that were superseded while their result was queued
+        if cancel is not self._waveformTaskCancel or cancel.is_set():
+            return
+        self._waveformTaskCancel = None
+
+        # Clusters may have been removed while the task was running
+        replotted = []
+        timestamps = self.data.waveform_timestamps
+        for cluster, clusterStats in zip(clusters, stats):
+            plotItems = self.plotItems.get(cluster)
+            if plotItems is None:
+                continue
+            oldItems = self.waveformItems.pop(cluster, [])
+            for item in oldItems:
+                self.waveformPlot.removeItem(item)
+            oldIds = {id(item) for item in oldItems}
+            plotItems[:] = [item for item in plotItems if id(item) not in oldIds]
+            items = [] if clusterStats is None else plot_waveform_stats(self.waveformPlot, timestamps, clusterStats,
+                                                                        cluster.color)
+            plotItems.extend(items)
+            self.waveformItems[cluster] = items
+            replotted.append(cluster)
+        self.onVisibilityChanged(replotted)
 
     def keyPressEvent(self, event: QKeyEvent):
         if event.key() == Qt.Key.Key_Return and self.roi is not None:
@@ -236,8 +358,56 @@ class FeaturesPlot(QWidget):
             if not self.roi.completed:
                 self.roi.completeDrawing()
                 self.selectFromROI(self.roi)
-                self.roi.sigRegionChanged.connect(self.selectFromROI)
+                self.roi.sigRegionChangeFinished.connect(self.selectFromROI)
             # Second press: finalize selection and delete roi
             else:
-                self.roi.sigRegionChanged.disconnect(self.selectFromROI)
+                self.roi.sigRegionChangeFinished.disconnect(self.selectFromROI)
                 self.deleteROI()
+
+
+class _SelectFromROITask(QRunnable):
+    """Selects points inside an ROI on a QThreadPool thread. NumPy releases the GIL, so the UI stays responsive."""
+
+    def __init__(self, edges: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], sortedPoints: np.ndarray,
+                 order: np.ndarray, cancel: threading.Event, ready: pyqtSignal):
+        super().__init__()
+        self.edges = edges
+        self.sortedPoints = sortedPoints
+        self.order = order
+        self.cancel = cancel
+        self.ready = ready
+
+    def run(self):
+        inside = contains_sorted_points(self.sortedPoints[:, 0], self.sortedPoints[:, 1], self.edges,
+                                        np.empty(self.order.size, dtype=bool), cancel=self.cancel)
+        if inside is None:
+            return
+        selection = np.empty(self.order.size, dtype=bool)
+        selection[self.order] = inside
+        if not self.cancel.is_set():
+            self.ready.emit(selection, self.cancel)
+
+
+class _WaveformStatsTask(QRunnable):
+    """Computes mean waveform statistics of the selected spikes in each cluster on a QThreadPool thread."""
+
+    def __init__(self, clusters: list[ClusterItem], indices: list[np.ndarray], selection: np.ndarray,
+                 waveforms: np.ndarray, cancel: threading.Event, ready: pyqtSignal):
+        super().__init__()
+        self.clusters = clusters
+        self.indices = indices
+        self.selection = selection
+        self.waveforms = waveforms
+        self.cancel = cancel
+        self.ready = ready
+
+    def run(self):
+        stats = []
+        for indices in self.indices:
+            if self.cancel.is_set():
+                return
+            if self.selection is not None:
+                indices = indices[self.selection[indices]]
+            stats.append(waveform_stats(self.waveforms[indices]) if indices.size > 0 else None)
+        if not self.cancel.is_set():
+            self.ready.emit(self.clusters, stats, self.cancel)
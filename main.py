@@ -19,7 +19,7 @@ if __name__ == '__main__':
     # del cont_data
 
     # Spike sorting
-    spike_features = extract_features(spike_data, ndims=5, method='haar')
-    spike_labels = cluster(spike_features, n_clusters=3, method='kmeans')
+    spike_features = extract_features(spike_data, ndims=5, method='haar', n_jobs=-1)
+    spike_labels = cluster(spike_features, n_clusters=3, method='kmeans', n_jobs=-1)
 
     app = start_app(spike_data, spike_features, spike_labels)
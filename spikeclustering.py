@@ -1,12 +1,29 @@
+import functools
 import typing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from scipy.cluster.vq import kmeans2
 from spikefeatures import SpikeFeatures
 
 
-def cluster(data: typing.Union[np.ndarray, SpikeFeatures, list[SpikeFeatures]], n_clusters=3, method='kmeans'):
+def cluster(data: typing.Union[np.ndarray, SpikeFeatures, list[SpikeFeatures]], n_clusters=3, method='kmeans',
+            n_jobs=1, seed: int = None):
+    """
+    :param method: 'kmeans' (scipy kmeans2), or, with scikit-learn installed, 'kmeans_mb' (MiniBatchKMeans, for many
+        spikes) or 'kmeans_elkan' (KMeans with Elkan's algorithm)
+    :param n_jobs: when data is a list (e.g. one entry per channel), number of worker processes to cluster the entries
+        in parallel: -1 (all cores) or a positive integer. (default 1, cluster in this process)
+    :param seed: (optional) random seed, for reproducible labels
+    """
+    if not (n_jobs == -1 or n_jobs >= 1):
+        raise ValueError(f"n_jobs must be -1 or >= 1, got {n_jobs}")
     if type(data) is list:
-        return [cluster(d) for d in data]
+        if n_jobs == 1 or len(data) <= 1:
+            return [cluster(d, n_clusters=n_clusters, method=method, seed=seed) for d in data]
+        # Send only the feature arrays to worker processes
+        data = [d.features if isinstance(d, SpikeFeatures) else d for d in data]
+        with ProcessPoolExecutor(max_workers=None if n_jobs == -1 else n_jobs) as executor:
+            return list(executor.map(functools.partial(cluster, n_clusters=n_clusters, method=method, seed=seed), data))
 
     if isinstance(data, SpikeFeatures):
         data = data.features
@@ -15,13 +32,28 @@ def cluster(data: typing.Union[np.ndarray, SpikeFeatures, list[SpikeFeatures]],
         raise TypeError(f"data is type {type(data)}, expected np.ndarray, SpikeFeatures, or list[SpikeFeatures]")
 
     if method == 'kmeans':
-        _, labels = kmeans2(data, n_clusters)
-        return labels
+        # k-means++ seeding spreads initial centroids over the data, instead of sampling them from a fitted Gaussian
+        _, labels = kmeans2(data, n_clusters, minit='++', seed=seed)
+    elif method == 'kmeans_mb':
+        from sklearn.cluster import MiniBatchKMeans
+        labels = MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=3, random_state=seed).fit_predict(data)
+    elif method == 'kmeans_elkan':
+        from sklearn.cluster import KMeans
+        labels = KMeans(n_clusters=n_clusters, algorithm='elkan', n_init=3, random_state=seed).fit_predict(data)
     else:
-        raise ValueError(f"Unsupported clustering method {method}, expected 'kmeans', 'gaussian', 'nn'")
+        raise ValueError(f"Unsupported clustering method {method}, expected 'kmeans', 'kmeans_mb', 'kmeans_elkan'")
+
+    # Smallest unsigned dtype that holds all labels (uint8 for up to 256 clusters), to cut memory traffic later on
+    return labels.astype(np.min_scalar_type(n_clusters - 1), copy=False)
+
+
+def _n_clusters(labels: np.ndarray) -> int:
+    """labels.max() + 1, or 0 if labels is empty. As a Python int, so it does not overflow small label dtypes."""
+    return int(labels.max()) + 1 if labels.size else 0
 
 
-def move_clusters(labels: np.ndarray, source: int, count: int, destination: int, in_place=False):
+def move_clusters(labels: np.ndarray, source: int, count: int, destination: int, in_place=False,
+                  n_clusters: int = None):
     """
     Reorder existing cluster labels by moving one cluster (or several contiguous clusters) to a new index. The new
     cluster labels will still start at 0 and end at n_clusters. By default returns a modified copy unless in_place=True
@@ -31,28 +63,27 @@ def move_clusters(labels: np.ndarray, source: int, count: int, destination: int,
     :param count: number of clusters to be moved
     :param destination: destination index to move source to, actual index they end up in is: destination (if moving up), destination - count (if moving down)
     :param in_place: (default False) True to modify original labels array. False to return a modified copy. Performance is the same either way
+    :param n_clusters: (optional) number of clusters, labels.max() + 1. Passing it skips a scan over labels.
     :return: modified cluster labels array.
     """
     if source == destination:
         return
+    if source < destination < source + count:
+        raise ValueError(f"Cannot move clusters [{source}, {source + count}) to {destination}, which is inside the moved range")
 
-    n_clusters = labels.max(initial=-1) + 1
-    old_values = list(range(n_clusters))
-    new_values = old_values.copy()
+    if n_clusters is None:
+        n_clusters = _n_clusters(labels)
+    old_values = np.arange(n_clusters)
+    moved = old_values[source:source + count]
+    remaining = np.delete(old_values, np.s_[source:source + count])
 
-    # Moving up
-    if source > destination:
-        del new_values[source:source + count]
-        new_values[destination:destination] = old_values[source:source + count]
-    # Moving down
-    else:
-        new_values[destination:destination] = old_values[source:source + count]
-        del new_values[source:source + count]
+    # Moving up: insert before destination. Moving down: destination counts the moved clusters, which were removed.
+    new_values = np.insert(remaining, destination if source > destination else destination - count, moved)
 
-    return remap_clusters(labels, old_values, new_values, in_place=in_place)
+    return remap_clusters(labels, old_values, new_values, in_place=in_place, n_clusters=n_clusters)
 
 
-def remap_clusters(labels: np.ndarray, old_values: typing.Union[list[int], tuple[int]], new_values: typing.Union[list[int], tuple[int]], in_place=False):
+def remap_clusters(labels: np.ndarray, old_values: typing.Union[list[int], tuple[int]], new_values: typing.Union[list[int], tuple[int]], in_place=False, n_clusters: int = None):
     """
     Replace label values in labels with new values, by projecting old_values -> new_values. All values are int.
 
@@ -60,71 +91,124 @@ def remap_clusters(labels: np.ndarray, old_values: typing.Union[list[int], tuple
     :param old_values: old values to find and replace
     :param new_values: new values to replace with, old_values and new_values should have same length
     :param in_place:
+    :param n_clusters: (optional) number of clusters, labels.max() + 1. Passing it skips a scan over labels.
     :return:
     """
 
-    if in_place:
-        old_labels = labels.copy()
-        new_labels = labels
-    else:
-        old_labels = labels
-        new_labels = labels.copy()
-
     if len(old_values) != len(new_values):
         raise ValueError(f"Cannot remap labels, because old_values {len(old_values)} is not the same length as {len(new_values)}")
 
-    for i in range(len(old_values)):
-        ov = old_values[i]
-        nv = new_values[i]
-        if ov == nv:
-            continue
-        new_labels[old_labels == ov] = nv
-
+    # Nothing to remap
+    if np.array_equal(old_values, new_values):
+        return labels if in_place else labels.copy()
+
+    new_labels = labels if in_place else np.empty_like(labels)
+    if labels.size == 0:
+        return new_labels
+
+    # Lookup table from every label to its new value, applied in a single gather. Reads come from the table, so
+    # writing the result back into labels (in_place) needs no snapshot of the old labels. mode='clip' because
+    # np.take buffers the whole output in the default mode='raise'; the table covers every label anyway.
+    if n_clusters is None:
+        n_clusters = _n_clusters(labels)
+    lut = np.arange(max(n_clusters, max(old_values, default=-1) + 1), dtype=labels.dtype)
+    lut[np.asarray(old_values, dtype=np.intp)] = new_values
+
+    # Rotating all labels (e.g. moving the first cluster to the end) is cheaper as (labels + shift) % k than as a gather
+    k, shift = lut.size, int(lut[0])
+    if 0 < shift and k - 1 + shift <= np.iinfo(labels.dtype).max and np.array_equal(lut, (np.arange(k) + shift) % k):
+        np.add(labels, shift, out=new_labels)
+        np.mod(new_labels, k, out=new_labels)
+        return new_labels
+
+    np.take(lut, labels, out=new_labels, mode='clip')
     return new_labels
 
 
-def split_cluster(data, labels: np.ndarray, indices: typing.Union[int, list[int], tuple[int]], n_clusters=3, method='kmeans', in_place=False) -> np.ndarray:
-    # Sub-cluster on specific clusters
+def split_cluster(data, labels: np.ndarray, indices: typing.Union[int, list[int], tuple[int]], n_clusters=3, method='kmeans', in_place=False,
+                  n_super_clusters: int = None) -> np.ndarray:
+    """
+    Sub-cluster specific clusters. Sub-clusters get new labels after the existing ones.
+
+    :param n_clusters: number of sub-clusters
+    :param in_place: True to modify the original array. False to return a new array, of a wider dtype if the new labels
+        do not fit in labels.dtype. Raises ValueError in that case if in_place=True.
+    :param n_super_clusters: (optional) number of existing clusters, labels.max() + 1. Passing it skips a scan over labels.
+    """
+    if n_super_clusters is None:
+        n_super_clusters = _n_clusters(labels)
+
+    # Shifted sub-cluster labels may not fit in a small label dtype (e.g. uint8 from cluster()). Checked before clustering.
+    dtype = np.promote_types(labels.dtype, np.min_scalar_type(n_super_clusters + n_clusters - 1))
+    if in_place and dtype != labels.dtype:
+        raise ValueError(f"Cannot split in place, sub-cluster labels up to {n_super_clusters + n_clusters - 1} do not fit in {labels.dtype}")
+
+    # Spike indices are found once, then used both to gather the sub-cluster features and to write back their labels
     if type(indices) is int:
-        is_sub_data = labels == indices
+        sub_indices = np.flatnonzero(labels == indices)
     else:
-        is_sub_data = np.isin(labels, indices)
-    sub_labels = cluster(data[is_sub_data], n_clusters=n_clusters, method=method)
+        sub_indices = np.flatnonzero(_label_mask(labels, indices, n_super_clusters))
+    sub_labels = cluster(np.take(data, sub_indices, axis=0), n_clusters=n_clusters, method=method)
 
     # Shift sub-cluster labels so they don't overlap with original labels
-    n_super_clusters = labels.max(initial=-1) + 1
     # n_sub_clusters = sub_labels.max(initial=-1) + 1
+    sub_labels = sub_labels.astype(dtype, copy=False)
     sub_labels += n_super_clusters
 
     # Write to original array, or a new copy if in_place=False
-    out_labels = labels if in_place else labels.copy()
-    out_labels[is_sub_data] = sub_labels
+    out_labels = labels if in_place else labels.astype(dtype)
+    out_labels[sub_indices] = sub_labels
     return out_labels
 
 
-def merge_clusters(labels: np.ndarray, indices: typing.Union[list[int], tuple[int]], consolidate=True, in_place=False) -> np.ndarray:
+def _label_mask(labels: np.ndarray, indices: typing.Union[list[int], tuple[int]], n_clusters: int = None) -> np.ndarray:
+    """Same as np.isin(labels, indices), for non-negative int labels, by a single gather from a bool lookup table."""
+    if n_clusters is None:
+        n_clusters = _n_clusters(labels)
+    lut = np.zeros(max(n_clusters, max(indices) + 1), dtype=bool)
+    lut[np.asarray(indices, dtype=np.intp)] = True
+    return lut[labels]
+
+
+def merge_clusters(labels: np.ndarray, indices: typing.Union[list[int], tuple[int]], consolidate=True, in_place=False,
+                   n_clusters: int = None) -> np.ndarray:
     """
     Merge 2 or more clusters. Optionally consolidate cluster indices using consolidate_clusters()
     :param labels: 1d NumPy array containing cluster indices
     :param indices:
     :param consolidate:
     :param in_place: True to modify the original array. False to return a new array.
+    :param n_clusters: (optional) number of clusters, labels.max() + 1. Passing it skips the scans over labels.
     :return:
     """
     out_labels = labels if in_place else labels.copy()
-    out_labels[np.isin(labels, indices)] = np.min(indices)
+    merged = _label_mask(labels, indices, n_clusters)
+    # A boolean mask write branches on every spike. Writing through integer indices is faster, unless most spikes are
+    # merged, where np.putmask wins.
+    if np.count_nonzero(merged) < 0.75 * merged.size:
+        out_labels[np.flatnonzero(merged)] = np.min(indices)
+    else:
+        np.putmask(out_labels, merged, np.min(indices))
     if consolidate:
-        consolidate_clusters(out_labels, in_place=True)
+        # Merging only lowers labels, so n_clusters still bounds them
+        consolidate_clusters(out_labels, in_place=True, n_clusters=n_clusters)
     return out_labels
 
 
-def consolidate_clusters(labels: np.ndarray, in_place=False) -> np.ndarray:
-    """Shift cluster indices so that they range from [0, n_clusters)"""
-    out_labels = labels if in_place else labels.copy()
-    indices = np.sort(np.unique(labels))
-
-    for i in range(1, len(indices)):
-        if indices[i] > indices[i - 1] + 1:
-            out_labels[labels == indices[i]] = indices[i - 1] + 1
-            indices[i] = indices[i - 1] + 1
+def consolidate_clusters(labels: np.ndarray, in_place=False, n_clusters: int = None) -> np.ndarray:
+    """Shift cluster indices so that they range from [0, n_clusters). Passing n_clusters (an upper bound on
+    labels.max() + 1) skips a scan over labels."""
+    out_labels = labels if in_place else np.empty_like(labels)
+    if labels.size == 0:
+        return out_labels
+
+    # Labels in use, in ascending order, each mapped to the next free index after the lowest label
+    if n_clusters is None:
+        n_clusters = _n_clusters(labels)
+    in_use = np.zeros(n_clusters, dtype=bool)
+    in_use[labels] = True
+    indices = np.flatnonzero(in_use)
+    lut = np.empty(indices[-1] + 1, dtype=labels.dtype)
+    lut[indices] = np.arange(indices[0], indices[0] + indices.size)
+    np.take(lut, labels, out=out_labels, mode='clip')  # No output buffer, see remap_clusters
     return out_labels
@@ -51,7 +51,10 @@ def estimate_sd(data):
         data = data.data
 
     if isinstance(data, np.ndarray):
-        return np.median(np.abs(data - np.median(data, axis=0)), axis=0) / 0.6745
+        # Absolute deviations are computed in place, and the median may then partition that buffer instead of a copy
+        deviation = np.subtract(data, np.median(data, axis=0), dtype=np.float64)
+        np.abs(deviation, out=deviation)
+        return np.median(deviation, axis=0, overwrite_input=True) / 0.6745
     else:
         raise TypeError(f"param 'data' is type {type(data)}, expected numpy.ndarray or ContinuousData.")
 
@@ -95,7 +98,7 @@ def find_waveforms(data, sample_rate=None, electrode_map=None, direction=-1, n_s
     (n_samples, n_channels) = data.shape
     waveform_window_samples = np.rint(np.array(waveform_window) * sample_rate).astype(int)
 
-    n_samples_per_waveform = -waveform_window_samples[0] + waveform_window_samples[1] + 1
+    waveform_offsets = np.arange(waveform_window_samples[0], waveform_window_samples[1] + 1)
 
     from spikedata import SpikeData
     spike_data = [SpikeData(channel=i, sample_rate=sample_rate,
@@ -109,45 +112,30 @@ def find_waveforms(data, sample_rate=None, electrode_map=None, direction=-1, n_s
         threshold_return = None if configs[chn].threshold_return is None else configs[chn].threshold_return
         threshold_reject = None if configs[chn].threshold_reject is None else configs[chn].threshold_reject
 
+        # find_peaks works on a contiguous float64 copy of its input. Build that copy here, flipping the sign in the
+        # same pass, rather than have find_peaks convert the (int) product of a second copy.
+        signal = np.multiply(data[:, chn], direction, dtype=np.float64)
         if threshold_reject is not None:
-            i_peaks, _ = find_peaks(data[:, chn] * direction, height=(threshold*direction, threshold_reject*direction))
+            i_peaks, _ = find_peaks(signal, height=(threshold*direction, threshold_reject*direction))
         else:
-            i_peaks, _ = find_peaks(data[:, chn] * direction, height=threshold*direction)
-
-        n_waveforms = len(i_peaks)
-        spike_data[chn].waveforms = np.empty((n_waveforms, n_samples_per_waveform), dtype=np.int16, order='C')
-        spike_data[chn].sample_indices = np.empty((n_waveforms,), dtype=np.int32)
-        spike_data[chn].waveform_timestamps = np.array(
-            [t / sample_rate for t in range(waveform_window_samples[0], waveform_window_samples[1] + 1)])
-        assert spike_data[chn].waveform_timestamps.size == n_samples_per_waveform
-
-        i_waveform = 0
-        for i_sample in i_peaks:
-            waveform = data[i_sample + waveform_window_samples[0]:i_sample + waveform_window_samples[1] + 1, chn]
-            if _validate_waveform(waveform, -waveform_window_samples[0], threshold_return, direction, n_samples_per_waveform):
-                spike_data[chn].waveforms[i_waveform, :] = waveform
-                spike_data[chn].sample_indices[i_waveform] = i_sample
-                i_waveform += 1
-
-        # Cull invalid waveforms and indices from the over-allocated arrays
-        if i_waveform < n_waveforms:
-            # NOTE: np.ndarray.resize() flattens in memory order, reallocates and then reshapes.
-            # This means a C-contiguous array is correctly resized when trimmed ONLY along axis=0
-            assert spike_data[chn].waveforms.flags.c_contiguous
-            spike_data[chn].waveforms.resize((i_waveform, n_samples_per_waveform), refcheck=False)
-            spike_data[chn].sample_indices.resize((i_waveform,), refcheck=False)
+            i_peaks, _ = find_peaks(signal, height=threshold*direction)
 
-        spike_data[chn].timestamps = spike_data[chn].sample_indices / sample_rate
+        # Keep peaks whose waveform window lies within the recording
+        i_peaks = i_peaks[(i_peaks + waveform_window_samples[0] >= 0) & (i_peaks + waveform_window_samples[1] < n_samples)]
 
-    return spike_data
+        # Extract all waveforms of this channel with a single gather, (n_waveforms, n_samples_per_waveform)
+        waveforms = data[i_peaks[:, np.newaxis] + waveform_offsets, chn].astype(np.int16, copy=False)
 
+        # Waveforms must return to threshold_return after the peak
+        if threshold_return is not None:
+            is_valid = np.any(waveforms[:, -waveform_window_samples[0]:] * direction <= threshold_return * direction,
+                              axis=1)
+            i_peaks = i_peaks[is_valid]
+            waveforms = waveforms[is_valid]
 
-def _validate_waveform(waveform, center_index, threshold_return, direction, n_samples_per_waveform) -> bool:
-    """Returns True if waveform meets length and return-to-threshold requirements."""
-    if waveform.size != n_samples_per_waveform:
-        return False
-    elif threshold_return is None:
-        return True
-    else:
-        return np.any(waveform[center_index:] * direction <= threshold_return * direction)
+        spike_data[chn].waveforms = waveforms
+        spike_data[chn].sample_indices = i_peaks.astype(np.int32)
+        spike_data[chn].waveform_timestamps = waveform_offsets / sample_rate
+        spike_data[chn].timestamps = spike_data[chn].sample_indices / sample_rate
 
+    return spike_data
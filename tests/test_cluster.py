@@ -0,0 +1,49 @@
+import unittest
+from spikeclustering import *
+
+
+class TestCluster(unittest.TestCase):
+    n_channels = 3
+    n_waveforms = 500
+
+    @staticmethod
+    def _generate_features(n_waveforms, seed):
+        rng = np.random.default_rng(seed)
+        centers = np.asarray([[0, 0], [10, 0], [0, 10], [10, 10]])
+        return centers[rng.integers(len(centers), size=n_waveforms)] + rng.standard_normal((n_waveforms, 2))
+
+    def test_cluster_list_in_parallel(self):
+        features = [self._generate_features(self.n_waveforms, seed) for seed in range(self.n_channels)]
+        for n_jobs in (1, 2):
+            labels = cluster(features, n_clusters=4, n_jobs=n_jobs)
+            self.assertEqual(len(labels), self.n_channels)
+            for i in range(self.n_channels):
+                self.assertEqual(labels[i].shape, (self.n_waveforms,))
+                self.assertTrue(labels[i].max() < 4)
+                self.assertEqual(labels[i].dtype, np.uint8)
+
+    def test_cluster_invalid_n_jobs(self):
+        features = [self._generate_features(self.n_waveforms, i) for i in range(self.n_channels)]
+        for n_jobs in (0, -2):
+            with self.subTest(n_jobs=n_jobs), self.assertRaises(ValueError):
+                cluster(features, n_clusters=4, n_jobs=n_jobs)
+
+    def test_cluster_seed(self):
+        features = self._generate_features(self.n_waveforms, 0)
+        self.assertTrue(np.array_equal(cluster(features, n_clusters=4, seed=1), cluster(features, n_clusters=4, seed=1)))
+
+    def test_split_cluster_widens_labels(self):
+        features = self._generate_features(self.n_waveforms, 0)
+        # Labels 0-254, so 3 more clusters no longer fit in uint8
+        labels = np.zeros(self.n_waveforms, dtype=np.uint8)
+        labels[-254:] = np.arange(1, 255)
+        with self.assertRaises(ValueError):
+            split_cluster(features, labels, 0, n_clusters=3, in_place=True)
+        split = split_cluster(features, labels, 0, n_clusters=3)
+        self.assertEqual(split.dtype, np.uint16)
+        self.assertTrue(np.array_equal(split[labels != 0], labels[labels != 0]))
+        self.assertTrue(np.all(split[labels == 0] >= 255))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import unittest
+import numpy as np
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt6.QtCore import QModelIndex
+from PyQt6.QtWidgets import QApplication
+from gui.cluster.model import ClusterTreeModel
+
+
+class TestClusterTreeModel(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication([])
+
+    def test_load_nested_single_child_group(self):
+        # Second cluster is a group with a single child
+        indices = [np.arange(0, 10), [np.arange(10, 20)], [np.arange(20, 25), np.arange(25, 30)]]
+        model = ClusterTreeModel()
+        model.loadIndices(indices, seed=0)
+
+        root = QModelIndex()
+        self.assertEqual(model.rowCount(root), 3)
+        self.assertTrue(model.index(1, 0, root).internalPointer().isLeaf())
+        self.assertEqual(model.index(1, 0, root).internalPointer().size, 10)
+
+        self.assertTrue(model.merge([model.index(0, 0, root), model.index(1, 0, root)]))
+        self.assertEqual(model.rowCount(root), 2)
+        self.assertEqual(sorted(leaf.size for leaf in model.rootItem.leaves()), [5, 5, 20])
+
+
+if __name__ == '__main__':
+    unittest.main()
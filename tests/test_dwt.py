@@ -11,6 +11,27 @@ class TestDWT(unittest.TestCase):
         self.assertTrue(data_transformed.shape == (3, 16))
         self.assertTrue(np.allclose(data_transformed_ground_truth, data_transformed[1, :]))
 
+    def test_haar_transform_reuses_matrix(self):
+        data = np.random.default_rng(0).standard_normal((4, 32))
+        y1, h1 = haar_transform(data)
+        y2, h2 = haar_transform(data)
+        self.assertIs(h1, h2)
+        self.assertFalse(h1.flags.writeable)
+        self.assertTrue(np.allclose(h1, haar_matrix(32)))
+        self.assertTrue(np.allclose(y1, y2))
+        _, h3 = haar_transform(data, orthogonal=False)
+        self.assertIsNot(h1, h3)
+
+    def test_haar_transform_dtype(self):
+        data = np.random.default_rng(0).standard_normal((4, 10))
+        y64, _ = haar_transform(data)
+        y32, _ = haar_transform(data.astype(np.float32))
+        self.assertEqual(y64.dtype, np.float64)
+        self.assertEqual(y32.dtype, np.float32)
+        self.assertTrue(np.allclose(y64, y32, atol=1e-5))
+        y_int, _ = haar_transform(np.arange(16, dtype=np.int16).reshape(2, 8))
+        self.assertEqual(y_int.dtype, np.float64)
+
     def test_conform_shape_to_pow2(self):
         # for l in range(2, 31):
         l = 14
@@ -1,3 +1,4 @@
+import tracemalloc
 import unittest
 from spikeclustering import *
 
@@ -5,10 +6,11 @@ from spikeclustering import *
 class TestReorderClusters(unittest.TestCase):
     n_clusters = 6
     n_waveforms = 10000
+    seed = 0xC0FFEE  # Fixed, so that failures are reproducible
 
-    @staticmethod
-    def _generate_clusters(n_clusters, n_waveforms):
-        rng = np.random.default_rng()
+    @classmethod
+    def _generate_clusters(cls, n_clusters, n_waveforms):
+        rng = np.random.default_rng(cls.seed)
         labels = rng.integers(n_clusters, size=n_waveforms)
         return labels
 
@@ -18,7 +20,7 @@ class TestReorderClusters(unittest.TestCase):
         labels = labels_original.copy()
 
         old_values = list(range(self.n_clusters))
-        new_values = list(np.random.permutation(old_values))
+        new_values = list(np.random.default_rng(self.seed).permutation(old_values))
 
         # Test remapping in place
         labels_remapped_inplace = remap_clusters(labels, old_values, new_values, in_place=True)
@@ -26,16 +28,29 @@ class TestReorderClusters(unittest.TestCase):
         for i in range(self.n_clusters):
             self.assertTrue(np.array_equal(labels_remapped_inplace == new_values[i], labels_original == old_values[i]))
 
+    def test_remap_clusters_in_place_no_copy(self):
+        labels = self._generate_clusters(self.n_clusters, self.n_waveforms)
+        address = labels.ctypes.data
+        tracemalloc.start()
+        try:
+            remap_clusters(labels, [0, 1], [1, 0], in_place=True)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(labels.ctypes.data, address)
+        self.assertLess(peak, labels.nbytes // 2)  # Only the lookup table is allocated
+
     def test_remap_clusters(self):
         labels_original = self._generate_clusters(self.n_clusters, self.n_waveforms)
         labels = labels_original.copy()
 
         old_values = list(range(self.n_clusters))
-        new_values = list(np.random.permutation(old_values))
+        new_values = list(np.random.default_rng(self.seed).permutation(old_values))
 
         # Test remapping, returning new array
         labels_remapped = remap_clusters(labels, old_values, new_values, in_place=False)
         self.assertIsNot(labels_remapped, labels)
+        self.assertEqual(labels_remapped.dtype, labels.dtype)
         for i in range(self.n_clusters):
             self.assertTrue(np.array_equal(labels_remapped == new_values[i], labels_original == old_values[i]))
 
@@ -43,6 +58,8 @@ class TestReorderClusters(unittest.TestCase):
         # Generate random labels
         labels_original = self._generate_clusters(self.n_clusters, self.n_waveforms)
         labels = labels_original.copy()
+        # Spikes in each original cluster, shared by all cases
+        masks = [labels_original == i for i in range(self.n_clusters)]
 
         for source in range(self.n_clusters):
             for count in range(1, self.n_clusters - source):
@@ -52,22 +69,68 @@ class TestReorderClusters(unittest.TestCase):
                     if destination in range(source, source + count):
                         continue
 
-                    labels_moved = move_clusters(labels, source, count, destination)
-
-                    old_values = list(range(self.n_clusters))
-                    new_values = old_values.copy()
-                    moved_values = old_values[source:source + count]
-                    # Moving up/left
-                    if source > destination:
-                        del new_values[source:source + count]
-                        new_values[destination:destination] = moved_values
-                    # Moving down/right
-                    else:
-                        new_values[destination:destination] = moved_values
-                        del new_values[source:source + count]
-
-                    for i in range(self.n_clusters):
-                        self.assertTrue(np.array_equal(labels_moved == new_values[i], labels_original == old_values[i]))
+                    with self.subTest(source=source, count=count, destination=destination):
+                        self._check_move_clusters(labels, masks, source, count, destination)
+
+    def _check_move_clusters(self, labels, masks, source, count, destination):
+        labels_moved = move_clusters(labels, source, count, destination)
+        self.assertEqual(labels_moved.dtype, labels.dtype)
+
+        old_values = list(range(self.n_clusters))
+        new_values = old_values.copy()
+        moved_values = old_values[source:source + count]
+        # Moving up/left
+        if source > destination:
+            del new_values[source:source + count]
+            new_values[destination:destination] = moved_values
+        # Moving down/right
+        else:
+            new_values[destination:destination] = moved_values
+            del new_values[source:source + count]
+
+        for i in range(self.n_clusters):
+            self.assertTrue(np.array_equal(labels_moved == new_values[i], masks[old_values[i]]))
+
+    def test_remap_clusters_partial(self):
+        labels = np.asarray([0, 3, 1, 3, 2, 5], dtype=np.uint32)
+        remapped = remap_clusters(labels, [3, 7], [1, 0])
+        self.assertTrue(np.array_equal(remapped, [0, 1, 1, 1, 2, 5]))
+        self.assertEqual(remapped.dtype, labels.dtype)
+        self.assertTrue(np.array_equal(labels, [0, 3, 1, 3, 2, 5]))  # Ensure original array was not modified
+        self.assertEqual(remap_clusters(labels[:0], [0], [1]).size, 0)
+
+    def test_remap_clusters_rotation(self):
+        labels = self._generate_clusters(self.n_clusters, self.n_waveforms)
+        old_values = list(range(self.n_clusters))
+        for shift in range(1, self.n_clusters):
+            new_values = [(v + shift) % self.n_clusters for v in old_values]
+            self.assertTrue(np.array_equal(remap_clusters(labels, old_values, new_values), (labels + shift) % self.n_clusters))
+
+        # Shifted labels would overflow uint8, falls back to the lookup table
+        labels = np.arange(256, dtype=np.uint8)
+        remapped = remap_clusters(labels, list(range(256)), [(v + 1) % 256 for v in range(256)])
+        self.assertTrue(np.array_equal(remapped, (np.arange(256) + 1) % 256))
+        self.assertEqual(remapped.dtype, np.uint8)
+
+    def test_remap_clusters_identity(self):
+        labels = self._generate_clusters(self.n_clusters, self.n_waveforms)
+        self.assertIs(remap_clusters(labels, [1, 2], [1, 2], in_place=True), labels)
+        remapped = remap_clusters(labels, [1, 2], [1, 2])
+        self.assertIsNot(remapped, labels)
+        self.assertTrue(np.array_equal(remapped, labels))
+
+    def test_merge_clusters_with_n_clusters(self):
+        labels = self._generate_clusters(self.n_clusters, self.n_waveforms)
+        merged = merge_clusters(labels, [1, 4])
+        self.assertTrue(np.array_equal(merge_clusters(labels, [1, 4], n_clusters=self.n_clusters), merged))
+        self.assertEqual(merged.max(), self.n_clusters - 2)
+        self.assertEqual(merged.dtype, labels.dtype)
+        self.assertTrue(np.array_equal(merge_clusters(labels, [0, 1, 2, 3, 5]), labels == 4))  # Mostly merged
+        labels_uint8 = labels.astype(np.uint8)
+        self.assertEqual(merge_clusters(labels_uint8, [1, 4]).dtype, np.uint8)
+        self.assertEqual(move_clusters(labels_uint8, 1, 2, 5).dtype, np.uint8)
+        self.assertTrue(np.array_equal(move_clusters(labels, 1, 2, 5, n_clusters=self.n_clusters),
+                                       move_clusters(labels, 1, 2, 5)))
 
 
 if __name__ == '__main__':
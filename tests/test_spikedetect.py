@@ -1,37 +1,57 @@
+import os
 import unittest
 import numpy as np
 import spikedetect
 from continuousdata import BlackrockContinuousData
 
-file = r'\\research.files.med.harvard.edu\neurobio\NEUROBIOLOGY SHARED\Assad Lab\Lingfeng\Data\daisy8\daisy8_20210708\daisy8_20210708.ns5 '
+# Set SPIKESORT_NS5_FIXTURE to a local Blackrock NSx file to use instead of the network share. It must be a real
+# recording: test_cull_waveforms expects some detected spikes not to return below n_sigmas_return.
+file = os.environ.get('SPIKESORT_NS5_FIXTURE', r'\\research.files.med.harvard.edu\neurobio\NEUROBIOLOGY SHARED\Assad Lab\Lingfeng\Data\daisy8\daisy8_20210708\daisy8_20210708.ns5 ')
 n_samples = 30000
-cd = BlackrockContinuousData()
-cd.read(file, n_samples=n_samples)
 
 
 class TestSpikeDetect(unittest.TestCase):
+    cd: BlackrockContinuousData = None
+    spike_data: dict = None  # find_waveforms results by keyword arguments, see find_waveforms
+
+    @classmethod
+    def setUpClass(cls):
+        # Read the file once for all tests, and only when they run
+        if not os.path.exists(file):
+            raise unittest.SkipTest(f"Data file {file} is not available")
+        cls.cd = BlackrockContinuousData.fromfile(file, n_samples=n_samples)
+        cls.spike_data = {}
+
+    def find_waveforms(self, **kwargs):
+        """spikedetect.find_waveforms on the test data, detected once per set of arguments and shared by all tests."""
+        key = tuple(sorted(kwargs.items()))
+        if key not in self.spike_data:
+            self.spike_data[key] = spikedetect.find_waveforms(self.cd, **kwargs)
+        return self.spike_data[key]
+
     def test_cull_waveforms(self):
         # Do two rounds of spike detection, the second round with less stringent conditions (less waveform culling).
-        spike_data_1 = spikedetect.find_waveforms(cd, n_sigmas=2.0, n_sigmas_return=1.0, n_sigmas_reject=None)
-        spike_data_2 = spikedetect.find_waveforms(cd, n_sigmas=2.0, n_sigmas_return=None, n_sigmas_reject=None)
+        spike_data_1 = self.find_waveforms(n_sigmas=2.0, n_sigmas_return=1.0, n_sigmas_reject=None)
+        spike_data_2 = self.find_waveforms(n_sigmas=2.0, n_sigmas_return=None, n_sigmas_reject=None)
 
         n_channels = len(spike_data_1)
 
-        n_waveforms_1 = [sd.waveforms.shape[0] for sd in spike_data_1]
-        n_waveforms_2 = [sd.waveforms.shape[0] for sd in spike_data_2]
-
-        n_culled_waveforms = [n_waveforms_2[chn] - n_waveforms_1[chn] for chn in range(n_channels)]
-        self.assertGreater(sum(n_culled_waveforms), 0, f"Waveform-culling likely failed, {sum(n_waveforms_1)} waveforms were detected in {n_channels} channels but none were culled.")
+        n_waveforms_1 = np.fromiter((sd.waveforms.shape[0] for sd in spike_data_1), dtype=np.int64, count=n_channels)
+        n_waveforms_2 = np.fromiter((sd.waveforms.shape[0] for sd in spike_data_2), dtype=np.int64, count=n_channels)
 
-        for chn in range(n_channels):
-            self.assertGreaterEqual(n_waveforms_2[chn], n_waveforms_1[chn], f"Waveform-culling likely failed on channel {chn}, where stronger spikedetect constraints resulted in {abs(n_waveforms_2[chn] - n_waveforms_1[chn])} additional waveforms.")
+        n_culled_waveforms = n_waveforms_2 - n_waveforms_1
+        self.assertGreater(int(n_culled_waveforms.sum()), 0, f"Waveform-culling likely failed, {n_waveforms_1.sum()} waveforms were detected in {n_channels} channels but none were culled.")
 
-            # Test numpy.ndarray.resize did not mess up the data
-            if n_waveforms_2[chn] > n_waveforms_1[chn]:
-                condition = np.array_equal(spike_data_1[chn].waveforms[0, :], spike_data_2[chn].waveforms[0, :])
-                msg = f"Waveform-culling likely failed on channel {chn}, first waveform {spike_data_2[chn].waveforms[0, :]} became {spike_data_1[chn].waveforms[0, :]} after culling. This is likely an error due to using numpy.ndarray.resize on a non-C-ordered NumPy array."
-                self.assertTrue(condition, msg)
+        regressed = np.flatnonzero(n_culled_waveforms < 0)
+        self.assertEqual(regressed.size, 0, f"Waveform-culling likely failed on channels {regressed.tolist()}, where stronger spikedetect constraints resulted in {(-n_culled_waveforms[regressed]).tolist()} additional waveforms.")
 
+        # Test numpy.ndarray.resize did not mess up the data, first waveforms of all culled channels compared at once
+        culled = np.flatnonzero(n_culled_waveforms > 0)
+        first_waveforms_1 = np.stack([spike_data_1[chn].waveforms[0, :] for chn in culled])
+        first_waveforms_2 = np.stack([spike_data_2[chn].waveforms[0, :] for chn in culled])
+        unchanged = (first_waveforms_1 == first_waveforms_2).all(axis=1)
+        msg = f"Waveform-culling likely failed on channels {culled[~unchanged].tolist()}, where the first waveform changed after culling. This is likely an error due to using numpy.ndarray.resize on a non-C-ordered NumPy array."
+        self.assertTrue(unchanged.all(), msg)
 
 if __name__ == '__main__':
     unittest.main()
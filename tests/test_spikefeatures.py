@@ -0,0 +1,32 @@
+import unittest
+import numpy as np
+from scipy import stats
+from spikefeatures import _ks_statistic_norm, extract_features
+
+
+class TestSpikeFeatures(unittest.TestCase):
+    def test_ks_statistic_norm(self):
+        rng = np.random.default_rng(0)
+        n = 2000
+        x = np.column_stack((rng.standard_normal(n), rng.exponential(size=n), rng.integers(0, 5, n), rng.uniform(size=n)))
+        expected = [stats.kstest((column - column.mean()) / column.std(), 'norm').statistic for column in x.T]
+        self.assertTrue(np.allclose(_ks_statistic_norm(x), expected))
+
+    def test_extract_features_list_in_parallel(self):
+        rng = np.random.default_rng(0)
+        waveforms = [rng.integers(-500, 500, size=(300, 32), dtype=np.int16) for _ in range(3)]
+        serial = extract_features(waveforms, ndims=5)
+        parallel = extract_features(waveforms, ndims=5, n_jobs=2)
+        self.assertEqual(len(parallel), len(waveforms))
+        for s, p in zip(serial, parallel):
+            self.assertTrue(np.array_equal(s.features, p.features))
+
+    def test_extract_features_invalid_n_jobs(self):
+        waveforms = [np.zeros((10, 32), dtype=np.int16)]
+        for n_jobs in (0, -2):
+            with self.subTest(n_jobs=n_jobs), self.assertRaises(ValueError):
+                extract_features(waveforms, ndims=5, n_jobs=n_jobs)
+
+
+if __name__ == '__main__':
+    unittest.main()